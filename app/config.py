@@ -3,12 +3,21 @@ Configuration management with proper validation and defaults.
 Handles missing API keys gracefully.
 """
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 from pydantic_settings import BaseSettings
 from pydantic import Field, field_validator
 import warnings
 
+BASE_DIR = Path(__file__).parent.parent
+
+
+@lru_cache(maxsize=8)
+def _absolute_path(relative_path: str) -> Path:
+    """Resolve a configured directory against the project root (memoized, called per request)."""
+    return BASE_DIR / relative_path
+
 
 class Settings(BaseSettings):
     """Application settings with validation and defaults."""
@@ -29,6 +38,7 @@ class Settings(BaseSettings):
     api_host: str = Field(default='0.0.0.0', env='API_HOST')
     api_port: int = Field(default=8000, env='API_PORT')
     api_workers: int = Field(default=4, env='API_WORKERS')
+    thread_pool_size: int = Field(default=40, env='THREAD_POOL_SIZE')  # Blocking I/O offload threads
     
     # CORS Settings
     allowed_origins: str = Field(
@@ -38,12 +48,21 @@ class Settings(BaseSettings):
     
     # Rate Limiting
     rate_limit_per_minute: int = Field(default=60, env='RATE_LIMIT_PER_MINUTE')
+    redis_url: Optional[str] = Field(default=None, env='REDIS_URL')  # Shared limiter across workers
     
     # Cleanup Settings
     cleanup_enabled: bool = Field(default=True, env='CLEANUP_ENABLED')
     cleanup_interval_hours: int = Field(default=24, env='CLEANUP_INTERVAL_HOURS')
     max_file_age_days: int = Field(default=7, env='MAX_FILE_AGE_DAYS')
     
+    # In-memory caches
+    metadata_cache_size: int = Field(default=128, env='METADATA_CACHE_SIZE')
+    metadata_cache_ttl: int = Field(default=3600, env='METADATA_CACHE_TTL')  # seconds
+    graph_cache_size: int = Field(default=128, env='GRAPH_CACHE_SIZE')
+    graph_cache_ttl: int = Field(default=3600, env='GRAPH_CACHE_TTL')  # seconds
+    listing_cache_size: int = Field(default=256, env='LISTING_CACHE_SIZE')
+    listing_cache_ttl: int = Field(default=3600, env='LISTING_CACHE_TTL')  # seconds
+    
     # Logging
     log_level: str = Field(default='INFO', env='LOG_LEVEL')
     log_format: str = Field(default='json', env='LOG_FORMAT')
@@ -86,8 +105,7 @@ class Settings(BaseSettings):
     
     def get_absolute_path(self, relative_path: str) -> Path:
         """Convert relative path to absolute path."""
-        base_dir = Path(__file__).parent.parent
-        return base_dir / relative_path
+        return _absolute_path(relative_path)
     
     def ensure_directories_exist(self):
         """Create necessary directories on startup."""
@@ -114,15 +132,11 @@ class Settings(BaseSettings):
         return self.allowed_origins
 
 
-# Global settings instance
-settings = Settings()
-
-# Validate configuration on import
-if not settings.ai_available:
-    print("[WARN] Running in NO-AI mode. Template-based summaries only.")
-    print("   To enable AI: Set GEMINI_API_KEY in .env file")
-else:
-    print("[OK] AI features enabled (Google Gemini)")
-
-# Ensure directories exist on import
-settings.ensure_directories_exist()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Get the application settings, constructing them on first use.
+    Directory creation happens in the app lifespan, not on import.
+    Memoized, so .env is parsed once per process.
+    """
+    return Settings()
@@ -7,18 +7,23 @@ Main FastAPI application with all critical fixes:
 - Rate limiting
 - File cleanup scheduler
 """
+import math
 import time
 from contextlib import asynccontextmanager
+import anyio
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 
-from app.config import settings
+from app.config import get_settings
 from app.routes import health, upload, files, summary, query, graph, comparison
+from app.services.process_pool import get_process_pool, shutdown_process_pool
 from utils.logger import setup_logger, RequestLogger
 from utils.cleanup import FileCleanupManager
 
+settings = get_settings()
+
 # Setup logging
 logger = setup_logger(__name__, settings.log_level, settings.log_format)
 request_logger = RequestLogger(logger)
@@ -26,6 +31,10 @@ request_logger = RequestLogger(logger)
 # Global cleanup manager
 cleanup_manager = None
 
+# Shared rate limit store (initialized in lifespan when REDIS_URL is set)
+redis_client = None
+rate_limit_script = None
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -41,6 +50,12 @@ async def lifespan(app: FastAPI):
         logger.error(f"Failed to create directories: {e}")
         raise
     
+    # Size the threadpool used to offload blocking filesystem work
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.thread_pool_size
+    
+    # One worker process pool for CPU-bound analysis, shared by all requests
+    get_process_pool()
+    
     # Initialize cleanup manager
     if settings.cleanup_enabled:
         global cleanup_manager
@@ -48,11 +63,26 @@ async def lifespan(app: FastAPI):
             upload_dir=settings.get_absolute_path(settings.upload_dir),
             summaries_dir=settings.get_absolute_path(settings.summaries_dir),
             max_age_days=settings.max_file_age_days,
-            cleanup_interval_hours=settings.cleanup_interval_hours
+            cleanup_interval_hours=settings.cleanup_interval_hours,
+            shared_cache_dirs=(summary.CONTENT_CACHE_DIRNAME,)
         )
         cleanup_manager.start_scheduled_cleanup()
         logger.info("✓ Cleanup scheduler started")
     
+    # Initialize shared rate limiter
+    if settings.redis_url:
+        global redis_client, rate_limit_script
+        try:
+            import redis.asyncio as redis
+            redis_client = redis.from_url(settings.redis_url)
+            await redis_client.ping()
+            # Runs via EVALSHA, loading the script on first use
+            rate_limit_script = redis_client.register_script(RATE_LIMIT_SCRIPT)
+            logger.info("✓ Redis rate limiter connected")
+        except Exception as e:
+            redis_client = None
+            logger.warning(f"Redis unavailable, using in-memory rate limiter: {e}")
+    
     # Log configuration
     logger.info(f"Configuration: AI={settings.ai_available}, Demo={settings.demo_mode}")
     logger.info(f"Max upload size: {settings.max_upload_size_mb}MB")
@@ -64,6 +94,9 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down...")
     if cleanup_manager:
         cleanup_manager.stop_scheduled_cleanup()
+    if redis_client is not None:
+        await redis_client.aclose()
+    shutdown_process_pool()
 
 
 # Create FastAPI app
@@ -85,37 +118,6 @@ app.add_middleware(
 )
 
 
-# Request timing and logging middleware
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    """Log all requests with timing information."""
-    start_time = time.time()
-    
-    try:
-        response = await call_next(request)
-        duration_ms = (time.time() - start_time) * 1000
-        
-        request_logger.log_request(
-            method=request.method,
-            path=request.url.path,
-            status_code=response.status_code,
-            duration_ms=duration_ms
-        )
-        
-        # Add timing header
-        response.headers["X-Process-Time"] = f"{duration_ms:.2f}ms"
-        return response
-    
-    except Exception as e:
-        duration_ms = (time.time() - start_time) * 1000
-        request_logger.log_error(e, context={
-            'method': request.method,
-            'path': request.url.path,
-            'duration_ms': duration_ms
-        })
-        raise
-
-
 # Global exception handlers
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -145,50 +147,140 @@ async def general_exception_handler(request: Request, exc: Exception):
     )
 
 
-# Rate limiting (simple in-memory implementation)
-from collections import defaultdict
-from datetime import datetime, timedelta
+# Rate limiting
+# Uses a shared Redis counter when REDIS_URL is configured so the limit holds
+# across workers. Otherwise falls back to an in-memory token bucket, whose
+# state is per worker process: with api_workers > 1 each worker enforces the
+# configured limit independently.
+from typing import Dict, Tuple
+
+RATE_LIMIT_WINDOW_SECONDS = 60
+RATE_LIMIT_WINDOW_NS = RATE_LIMIT_WINDOW_SECONDS * 1_000_000_000
+
+# INCR and EXPIRE run atomically server-side, so a key can never be left without
+# a TTL (which would block its IP forever). The TTL is also repaired on any hit
+# that finds it missing. Returns {count, ttl}.
+RATE_LIMIT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+local ttl = redis.call('TTL', KEYS[1])
+if ttl < 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    ttl = tonumber(ARGV[1])
+end
+return {count, ttl}
+"""
+
+# client_ip -> (available tokens, time.monotonic_ns() of last refill)
+rate_limit_buckets: Dict[str, Tuple[float, int]] = {}
+_last_rate_limit_purge = time.monotonic_ns()
+
+
+def _purge_rate_limit_buckets(now: int):
+    """Drop buckets idle for a full window; they would be refilled to capacity anyway."""
+    global _last_rate_limit_purge
+    cutoff = now - RATE_LIMIT_WINDOW_NS
+    for client_ip in [ip for ip, (_, last) in rate_limit_buckets.items() if last < cutoff]:
+        del rate_limit_buckets[client_ip]
+    _last_rate_limit_purge = now
+
+
+def _check_local_rate_limit(client_ip: str, limit: int) -> Tuple[bool, int, int]:
+    """
+    Consume a token from the in-memory bucket.
+    Returns (allowed, remaining, retry_after_seconds).
+    """
+    refill_per_ns = limit / RATE_LIMIT_WINDOW_NS
+    now = time.monotonic_ns()
+    
+    if now - _last_rate_limit_purge > RATE_LIMIT_WINDOW_NS:
+        _purge_rate_limit_buckets(now)
+    
+    # Refill tokens for the time elapsed since the last request
+    tokens, last_refill = rate_limit_buckets.get(client_ip, (limit, now))
+    tokens = min(limit, tokens + (now - last_refill) * refill_per_ns)
+    
+    if tokens < 1:
+        rate_limit_buckets[client_ip] = (tokens, now)
+        return False, 0, math.ceil((1 - tokens) / refill_per_ns / 1_000_000_000)
+    
+    tokens -= 1
+    rate_limit_buckets[client_ip] = (tokens, now)
+    return True, int(tokens), 0
+
 
-rate_limit_tracker = defaultdict(list)
+async def _check_redis_rate_limit(client_ip: str, limit: int) -> Tuple[bool, int, int]:
+    """
+    Count the request in a shared fixed window (atomic INCR + EXPIRE script).
+    Returns (allowed, remaining, retry_after_seconds).
+    """
+    key = f"rate_limit:{client_ip}"
+    count, ttl = await rate_limit_script(keys=[key], args=[RATE_LIMIT_WINDOW_SECONDS])
+    
+    if count > limit:
+        return False, 0, ttl if ttl > 0 else RATE_LIMIT_WINDOW_SECONDS
+    
+    return True, limit - count, 0
 
 
+# Rate limiting, request timing and logging share one middleware so each
+# request only passes through a single wrapper coroutine
 @app.middleware("http")
-async def rate_limit_middleware(request: Request, call_next):
-    """Simple rate limiting per IP address."""
+async def observability_middleware(request: Request, call_next):
+    """Rate limit per IP address, then log the request with timing information."""
     client_ip = request.client.host
-    current_time = datetime.now()
+    limit = settings.rate_limit_per_minute
     
-    # Clean old entries
-    rate_limit_tracker[client_ip] = [
-        timestamp for timestamp in rate_limit_tracker[client_ip]
-        if current_time - timestamp < timedelta(minutes=1)
-    ]
+    if redis_client is not None:
+        try:
+            allowed, remaining, retry_after = await _check_redis_rate_limit(client_ip, limit)
+        except Exception as e:
+            logger.warning(f"Redis rate limit check failed, using local limiter: {e}")
+            allowed, remaining, retry_after = _check_local_rate_limit(client_ip, limit)
+    else:
+        allowed, remaining, retry_after = _check_local_rate_limit(client_ip, limit)
     
     # Check rate limit
-    if len(rate_limit_tracker[client_ip]) >= settings.rate_limit_per_minute:
+    if not allowed:
         return JSONResponse(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             content={
                 "error": "RateLimitExceeded",
-                "message": f"Rate limit exceeded. Max {settings.rate_limit_per_minute} requests per minute.",
-                "retry_after": 60
+                "message": f"Rate limit exceeded. Max {limit} requests per minute.",
+                "retry_after": retry_after
             }
         )
     
-    # Add current request
-    rate_limit_tracker[client_ip].append(current_time)
+    start_ns = time.monotonic_ns()
     
-    response = await call_next(request)
-    response.headers["X-RateLimit-Limit"] = str(settings.rate_limit_per_minute)
-    response.headers["X-RateLimit-Remaining"] = str(
-        settings.rate_limit_per_minute - len(rate_limit_tracker[client_ip])
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        duration_ms = (time.monotonic_ns() - start_ns) / 1_000_000
+        request_logger.log_error(e, context={
+            'method': request.method,
+            'path': request.url.path,
+            'duration_ms': duration_ms
+        })
+        raise
+    
+    duration_ms = (time.monotonic_ns() - start_ns) / 1_000_000
+    request_logger.log_request(
+        method=request.method,
+        path=request.url.path,
+        status_code=response.status_code,
+        duration_ms=duration_ms
     )
     
+    # Add timing and rate limit headers
+    response.headers["X-Process-Time"] = f"{duration_ms:.2f}ms"
+    response.headers["X-RateLimit-Limit"] = str(limit)
+    response.headers["X-RateLimit-Remaining"] = str(remaining)
+    
     return response
 
 
 # Register routes
-app.include_router(health.router, prefix="/health", tags=["Health"])
+app.include_router(health.router, prefix="/health", tags=["Health"], default_response_class=ORJSONResponse)
 app.include_router(upload.router, prefix="/upload", tags=["Upload"])
 app.include_router(files.router, prefix="/files", tags=["Files"])
 app.include_router(summary.router, prefix="/summary", tags=["Summary"])
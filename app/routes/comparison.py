@@ -1,21 +1,51 @@
 """
 API Routes for Codebase Comparison
 """
+import asyncio
+from functools import lru_cache
 from fastapi import APIRouter, HTTPException, Query
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set
 from datetime import datetime
 
+from app.config import get_settings
 from app.models.codebase_metadata import CodebaseMetadata, CodebaseComparison
 from app.services.comparison import CodebaseComparator
 from app.services.metadata_builder import MetadataBuilder
+from app.services.upload_meta import count_files, read_upload_meta
+from utils.cache import TTLCache
 from utils.logger import setup_logger
 
 router = APIRouter()
 logger = setup_logger(__name__)
 
-# Cache for metadata
-_metadata_cache: Dict[str, CodebaseMetadata] = {}
+_refreshing: Set[str] = set()
+
+
+@lru_cache(maxsize=1)
+def _get_metadata_cache() -> TTLCache:
+    """Cache for metadata (bounded LRU; expired entries are served stale while refreshing)."""
+    settings = get_settings()
+    return TTLCache(maxsize=settings.metadata_cache_size, ttl=settings.metadata_cache_ttl)
+
+
+def _build_metadata(upload_id: str) -> CodebaseMetadata:
+    """Build metadata for an upload and store it in the cache."""
+    builder = MetadataBuilder(Path("uploads") / upload_id)
+    metadata = builder.build_metadata(upload_id)
+    _get_metadata_cache()[upload_id] = metadata
+    return metadata
+
+
+def _revalidate_metadata(upload_id: str):
+    """Rebuild expired metadata in the background."""
+    try:
+        _build_metadata(upload_id)
+        logger.info(f"Revalidated metadata for {upload_id}")
+    except Exception as e:
+        logger.warning(f"Background metadata refresh failed for {upload_id}: {e}")
+    finally:
+        _refreshing.discard(upload_id)
 
 
 @router.get("/metadata/{upload_id}", response_model=CodebaseMetadata)
@@ -27,23 +57,29 @@ async def get_codebase_metadata(
     Get standardized metadata for a codebase.
     Generates and caches metadata for comparison purposes.
     """
-    # Check cache
-    if not refresh and upload_id in _metadata_cache:
-        logger.info(f"Returning cached metadata for {upload_id}")
-        return _metadata_cache[upload_id]
-    
     upload_dir = Path("uploads") / upload_id
     
+    # Check cache
+    if not refresh:
+        metadata_cache = _get_metadata_cache()
+        if upload_id in metadata_cache:
+            logger.info(f"Returning cached metadata for {upload_id}")
+            return metadata_cache[upload_id]
+        
+        stale = metadata_cache.get_stale(upload_id)
+        if stale is not None and upload_dir.exists():
+            if upload_id not in _refreshing:
+                _refreshing.add(upload_id)
+                asyncio.get_running_loop().run_in_executor(None, _revalidate_metadata, upload_id)
+            logger.info(f"Returning stale metadata for {upload_id} while refreshing")
+            return stale
+    
     if not upload_dir.exists():
         raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
     
     try:
-        # Build metadata
-        builder = MetadataBuilder(upload_dir)
-        metadata = builder.build_metadata(upload_id)
-        
-        # Cache it
-        _metadata_cache[upload_id] = metadata
+        # Build and cache metadata
+        metadata = _build_metadata(upload_id)
         
         logger.info(f"Generated metadata for {upload_id}: {metadata.total_files} files")
         return metadata
@@ -71,8 +107,8 @@ async def compare_codebases(
     
     # Get metadata for both codebases
     try:
-        base_metadata = await get_codebase_metadata(base_upload_id)
-        compare_metadata = await get_codebase_metadata(compare_upload_id)
+        base_metadata = await get_codebase_metadata(base_upload_id, refresh=False)
+        compare_metadata = await get_codebase_metadata(compare_upload_id, refresh=False)
     except HTTPException:
         raise
     except Exception as e:
@@ -103,12 +139,13 @@ async def list_available_codebases() -> List[Dict]:
         return []
     
     codebases = []
+    metadata_cache = _get_metadata_cache()
     
     for upload_path in upload_dir.iterdir():
         if upload_path.is_dir():
             # Get cached metadata if available
-            if upload_path.name in _metadata_cache:
-                meta = _metadata_cache[upload_path.name]
+            if upload_path.name in metadata_cache:
+                meta = metadata_cache[upload_path.name]
                 codebases.append({
                     'upload_id': upload_path.name,
                     'name': meta.name,
@@ -117,13 +154,18 @@ async def list_available_codebases() -> List[Dict]:
                     'uploaded_at': meta.uploaded_at.isoformat()
                 })
             else:
-                # Basic info without full metadata
-                file_count = sum(1 for _ in upload_path.rglob('*') if _.is_file())
+                # Basic info from the upload sidecar, walking only if it is missing
+                upload_meta = read_upload_meta(upload_path)
+                if upload_meta is None:
+                    upload_meta = {
+                        'file_count': count_files(upload_path),
+                        'uploaded_at': datetime.fromtimestamp(upload_path.stat().st_mtime).isoformat()
+                    }
                 codebases.append({
                     'upload_id': upload_path.name,
                     'name': upload_path.name,
-                    'total_files': file_count,
-                    'uploaded_at': datetime.fromtimestamp(upload_path.stat().st_mtime).isoformat()
+                    'total_files': upload_meta['file_count'],
+                    'uploaded_at': upload_meta['uploaded_at']
                 })
     
     logger.info(f"Found {len(codebases)} available codebases")
@@ -133,8 +175,9 @@ async def list_available_codebases() -> List[Dict]:
 @router.delete("/metadata/{upload_id}/cache")
 async def clear_metadata_cache(upload_id: str) -> Dict:
     """Clear cached metadata for an upload."""
-    if upload_id in _metadata_cache:
-        del _metadata_cache[upload_id]
+    metadata_cache = _get_metadata_cache()
+    if metadata_cache.get_stale(upload_id) is not None:
+        del metadata_cache[upload_id]
         logger.info(f"Cleared metadata cache for {upload_id}")
         return {'message': f'Cache cleared for {upload_id}'}
     else:
@@ -1,15 +1,22 @@
 """
 File listing and content retrieval with proper error handling.
 """
+import io
 import os
+import codecs
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
 from datetime import datetime
 
+import anyio
 from fastapi import APIRouter, HTTPException, status, Query
 from pydantic import BaseModel
 
-from app.config import settings
+from app.config import get_settings
+from app.services.upload_meta import EXCLUDE_DIRS, is_excluded_dir
+from utils.cache import TTLCache
 from utils.logger import setup_logger
 
 router = APIRouter()
@@ -44,20 +51,44 @@ class FileContentResponse(BaseModel):
     encoding: str
 
 
+# Byte order marks checked before falling back to UTF-8 / latin-1.
+# UTF-32 must come first since its little-endian BOM starts with UTF-16's.
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
 class CodebaseParser:
     """Parse codebase and extract metadata."""
     
-    SUPPORTED_EXTENSIONS = ['.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.cpp', '.c', '.h']
-    EXCLUDE_DIRS = {'__pycache__', '.git', 'venv', 'node_modules', '.venv', 'env', 'build', 'dist'}
+    SUPPORTED_EXTENSIONS = frozenset({'.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.cpp', '.c', '.h'})
+    EXCLUDE_DIRS = EXCLUDE_DIRS
     
     def __init__(self, upload_dir: Path):
-        self.upload_dir = upload_dir
+        self.upload_dir = upload_dir.resolve()
     
-    def parse_directory(self, upload_id: str) -> List[FileMetadata]:
-        """
-        Recursively scan for supported files.
-        Includes error handling for permission issues.
-        """
+    def list_paths(self, upload_id: str) -> List[str]:
+        """Sorted relative paths of supported files, without stat-ing them."""
+        root_dir = self._get_root(upload_id)
+        return sorted(os.path.relpath(entry.path, root_dir) for entry in self._iter_entries(root_dir))
+    
+    def get_metadata(self, upload_id: str, relative_paths: List[str]) -> List[FileMetadata]:
+        """Build metadata for the given files, skipping any that can no longer be read."""
+        root_dir = self._get_root(upload_id)
+        files = []
+        for relative_path in relative_paths:
+            try:
+                files.append(self._extract_metadata(relative_path, root_dir))
+            except Exception as e:
+                logger.warning(f"Error processing file {relative_path}: {e}")
+        return files
+    
+    def _get_root(self, upload_id: str) -> str:
+        """Return the upload root directory, raising 404 if it is missing."""
         root_dir = self.upload_dir / upload_id
         
         if not root_dir.exists():
@@ -66,49 +97,44 @@ class CodebaseParser:
                 detail=f"Upload {upload_id} not found"
             )
         
-        files = []
-        errors = []
-        
+        return str(root_dir)
+    
+    def _iter_entries(self, dirpath: str) -> Iterator[os.DirEntry]:
+        """
+        Recursively yield DirEntry objects for supported files.
+        Handles permission issues by logging and skipping the directory.
+        """
         try:
-            for dirpath, dirnames, filenames in os.walk(root_dir):
-                # Skip excluded directories
-                dirnames[:] = [d for d in dirnames if d not in self.EXCLUDE_DIRS]
-                
-                for filename in filenames:
-                    if Path(filename).suffix in self.SUPPORTED_EXTENSIONS:
-                        try:
-                            filepath = Path(dirpath) / filename
-                            metadata = self._extract_metadata(filepath, root_dir)
-                            files.append(metadata)
-                        except Exception as e:
-                            errors.append(f"Error processing {filename}: {str(e)}")
-                            logger.warning(f"Error processing file {filename}: {e}")
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"Error reading directory {dirpath}: {e}")
+            return
         
-        except Exception as e:
-            logger.error(f"Error scanning directory {root_dir}: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Error scanning directory: {str(e)}"
-            )
-        
-        if errors:
-            logger.warning(f"Encountered {len(errors)} errors while parsing {upload_id}")
-        
-        return files
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not is_excluded_dir(entry.name):
+                    yield from self._iter_entries(entry.path)
+            else:
+                name = entry.name
+                dot = name.rfind('.')
+                if dot != -1 and name[dot:] in self.SUPPORTED_EXTENSIONS:
+                    yield entry
     
-    def _extract_metadata(self, filepath: Path, root_dir: Path) -> FileMetadata:
+    def _extract_metadata(self, relative_path: str, root_dir: str) -> FileMetadata:
         """Extract file metadata with error handling."""
         try:
-            stat = filepath.stat()
+            stat = os.stat(os.path.join(root_dir, relative_path))
+            filename = os.path.basename(relative_path)
             return FileMetadata(
-                filename=filepath.name,
-                relative_path=str(filepath.relative_to(root_dir)),
+                filename=filename,
+                relative_path=relative_path,
                 size_bytes=stat.st_size,
                 last_modified=datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                file_type=filepath.suffix[1:]  # Remove leading dot
+                file_type=filename[filename.rfind('.') + 1:]  # Remove leading dot
             )
         except Exception as e:
-            logger.error(f"Error extracting metadata for {filepath}: {e}")
+            logger.error(f"Error extracting metadata for {relative_path}: {e}")
             raise
     
     def read_file_content(
@@ -125,10 +151,10 @@ class CodebaseParser:
         full_path = root_dir / file_path
         
         # Security check: prevent path traversal
+        # (upload_dir is resolved once in __init__, so only full_path needs resolving)
         try:
             full_path = full_path.resolve()
-            root_dir = root_dir.resolve()
-            if not str(full_path).startswith(str(root_dir)):
+            if not full_path.is_relative_to(root_dir):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Invalid file path"
@@ -146,61 +172,149 @@ class CodebaseParser:
                 detail=f"File not found: {file_path}"
             )
         
-        # Try multiple encodings
-        encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-        
-        for encoding in encodings:
-            try:
-                with open(full_path, 'r', encoding=encoding) as f:
-                    lines = f.readlines()
+        content_range = None
+        try:
+            if start_line is not None and end_line is not None:
+                if start_line < 1 or end_line < start_line:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Invalid line range."
+                    )
+                content, total_lines, encoding = self._read_window(full_path, start_line, end_line)
                 
-                total_lines = len(lines)
+                # Validate line range
+                if end_line > total_lines:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Invalid line range. File has {total_lines} lines."
+                    )
+                content_range = {
+                    "start_line": start_line,
+                    "end_line": end_line
+                }
+            else:
+                # Whole file: read once, then decode the in-memory buffer
+                content, encoding = self._decode(full_path.read_bytes())
                 
-                # Apply pagination
-                content_range = None
-                if start_line is not None and end_line is not None:
-                    # Validate line range
-                    if start_line < 1 or end_line < start_line or end_line > total_lines:
-                        raise HTTPException(
-                            status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=f"Invalid line range. File has {total_lines} lines."
-                        )
-                    
-                    content_lines = lines[start_line-1:end_line]
-                    content_range = {
-                        "start_line": start_line,
-                        "end_line": end_line
-                    }
-                else:
-                    content_lines = lines
+                # Match text-mode universal newline handling
+                if '\r' in content:
+                    content = content.replace('\r\n', '\n').replace('\r', '\n')
                 
-                return FileContentResponse(
-                    upload_id=upload_id,
-                    file_path=file_path,
-                    total_lines=total_lines,
-                    content_range=content_range,
-                    content=''.join(content_lines),
-                    encoding=encoding
-                )
-            
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                logger.error(f"Error reading file {file_path}: {e}")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Error reading file: {str(e)}"
-                )
+                total_lines = content.count('\n')
+                if content and not content.endswith('\n'):
+                    total_lines += 1
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading file {file_path}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error reading file: {str(e)}"
+            )
         
-        # If all encodings failed
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Could not decode file with any supported encoding"
+        return FileContentResponse(
+            upload_id=upload_id,
+            file_path=file_path,
+            total_lines=total_lines,
+            content_range=content_range,
+            content=content,
+            encoding=encoding
         )
+    
+    @classmethod
+    def _read_window(cls, full_path: Path, start_line: int, end_line: int) -> Tuple[str, int, str]:
+        """
+        Stream a file, keeping only lines start_line..end_line and counting the rest.
+        Returns (window content, total lines, encoding).
+        """
+        with open(full_path, 'rb') as raw:
+            encodings = cls._candidate_encodings(raw.read(4))
+            for encoding in encodings:
+                raw.seek(0)
+                # newline=None gives the same universal newline handling as text mode
+                f = io.TextIOWrapper(raw, encoding=encoding, newline=None)
+                try:
+                    lines_before = sum(1 for _ in islice(f, start_line - 1))
+                    content_lines = list(islice(f, end_line - start_line + 1))
+                    total_lines = lines_before + len(content_lines) + sum(1 for _ in f)
+                    return ''.join(content_lines), total_lines, encoding
+                except UnicodeDecodeError:
+                    if encoding == encodings[-1]:
+                        raise
+                finally:
+                    # Leave the underlying file to the with block
+                    f.detach()
+    
+    @staticmethod
+    def _candidate_encodings(head: bytes) -> List[str]:
+        """
+        Encodings to try, in order, given the first bytes of a file:
+        the codec selected by a BOM, then UTF-8, then latin-1, which can
+        decode any byte sequence. A BOM-like prefix doesn't guarantee the
+        rest of the file is valid in that codec, so it's only the first guess.
+        """
+        for bom, encoding in _BOMS:
+            if head.startswith(bom):
+                return [encoding, 'utf-8', 'latin-1']
+        return ['utf-8', 'latin-1']
+    
+    @classmethod
+    def _decode(cls, data: bytes) -> Tuple[str, str]:
+        """Decode file bytes with the first candidate encoding that succeeds."""
+        encodings = cls._candidate_encodings(data[:4])
+        for encoding in encodings[:-1]:
+            try:
+                return data.decode(encoding), encoding
+            except UnicodeDecodeError:
+                continue
+        return data.decode(encodings[-1]), encodings[-1]
+
+
+@lru_cache(maxsize=1)
+def get_parser() -> CodebaseParser:
+    """Return the shared parser for the configured upload directory."""
+    settings = get_settings()
+    return CodebaseParser(settings.get_absolute_path(settings.upload_dir))
+
+
+@lru_cache(maxsize=1)
+def _get_listing_cache() -> TTLCache:
+    """
+    Cache of file listings: upload_id -> (root dir st_mtime_ns, sorted relative paths).
+    Uploads are immutable after extraction, and the upload and delete routes call
+    invalidate(); the root mtime check catches an upload directory being replaced.
+    """
+    settings = get_settings()
+    return TTLCache(maxsize=settings.listing_cache_size, ttl=settings.listing_cache_ttl)
+
 
+def invalidate(upload_id: str):
+    """Drop the cached file listing for an upload."""
+    _get_listing_cache().pop(upload_id, None)
 
-# Initialize parser
-parser = CodebaseParser(settings.get_absolute_path(settings.upload_dir))
+
+async def _get_paths(upload_id: str) -> List[str]:
+    """Return the upload's sorted file paths, re-walking only when the upload changed."""
+    parser = get_parser()
+    try:
+        root_mtime = (parser.upload_dir / upload_id).stat().st_mtime_ns
+    except FileNotFoundError:
+        invalidate(upload_id)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Upload {upload_id} not found"
+        )
+    
+    listing_cache = _get_listing_cache()
+    cached = listing_cache.get(upload_id)
+    if cached and cached[0] == root_mtime:
+        return cached[1]
+    
+    # No lock: concurrent first requests may walk the same upload twice, which
+    # is harmless, and requests for other uploads never wait on this walk
+    paths = await anyio.to_thread.run_sync(parser.list_paths, upload_id)
+    listing_cache[upload_id] = (root_mtime, paths)
+    return paths
 
 
 @router.get("/{upload_id}", response_model=FileListResponse)
@@ -215,18 +329,19 @@ async def list_files(
     logger.info(f"Listing files for upload {upload_id}")
     
     try:
-        # Parse directory
-        all_files = parser.parse_directory(upload_id)
+        # Walk the upload once (served from cache when unchanged)
+        paths = await _get_paths(upload_id)
         
-        # Apply pagination
-        total_files = len(all_files)
+        # Only the requested page is stat-ed
         start_idx = (page - 1) * page_size
         end_idx = start_idx + page_size
-        paginated_files = all_files[start_idx:end_idx]
+        paginated_files = await anyio.to_thread.run_sync(
+            get_parser().get_metadata, upload_id, paths[start_idx:end_idx]
+        )
         
         return FileListResponse(
             upload_id=upload_id,
-            total_files=total_files,
+            total_files=len(paths),
             page=page,
             page_size=page_size,
             files=paginated_files
@@ -255,7 +370,9 @@ async def get_file_content(
     logger.info(f"Reading file {path} from upload {upload_id}")
     
     try:
-        return parser.read_file_content(upload_id, path, start_line, end_line)
+        return await anyio.to_thread.run_sync(
+            get_parser().read_file_content, upload_id, path, start_line, end_line
+        )
     
     except HTTPException:
         raise
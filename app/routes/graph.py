@@ -1,19 +1,45 @@
 """
 API Routes for Dependency Graph
 """
+from functools import lru_cache
 from fastapi import APIRouter, HTTPException
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Tuple
 import logging
 import json
 
+from app.config import get_settings
 from app.services.dependency_graph import DependencyGraphBuilder
+from utils.cache import TTLCache
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Cache for computed graphs
-_graph_cache = {}
+
+@lru_cache(maxsize=1)
+def _get_graph_cache() -> TTLCache:
+    """
+    Cache for computed graphs: upload_id -> (builder, graph_data).
+    Bounded so long-running servers don't grow without limit.
+    """
+    settings = get_settings()
+    return TTLCache(maxsize=settings.graph_cache_size, ttl=settings.graph_cache_ttl)
+
+
+def _build_or_get(upload_id: str, upload_dir: Path) -> Tuple[DependencyGraphBuilder, Dict]:
+    """
+    Return the cached (builder, graph_data) for an upload, building and caching on a miss.
+    The builder keeps its graph state, so file-level queries can reuse it.
+    """
+    graph_cache = _get_graph_cache()
+    if upload_id in graph_cache:
+        logger.info(f"Returning cached graph for {upload_id}")
+        return graph_cache[upload_id]
+    
+    builder = DependencyGraphBuilder(upload_dir)
+    graph_data = builder.build_graph(upload_id)
+    graph_cache[upload_id] = (builder, graph_data)
+    return builder, graph_data
 
 
 @router.get("/graph/{upload_id}")
@@ -27,23 +53,14 @@ async def get_dependency_graph(upload_id: str) -> Dict:
         - circular_dependencies: Detected circular imports
         - statistics: Graph metrics
     """
-    # Check cache first
-    if upload_id in _graph_cache:
-        logger.info(f"Returning cached graph for {upload_id}")
-        return _graph_cache[upload_id]
-    
     upload_dir = Path("uploads") / upload_id
     
     if not upload_dir.exists():
         raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
     
     try:
-        # Build dependency graph
-        builder = DependencyGraphBuilder(upload_dir)
-        graph_data = builder.build_graph(upload_id)
-        
-        # Cache the result
-        _graph_cache[upload_id] = graph_data
+        # Build dependency graph (or reuse the cached one)
+        _, graph_data = _build_or_get(upload_id, upload_dir)
         
         logger.info(f"Successfully built graph for {upload_id}")
         return graph_data
@@ -70,14 +87,7 @@ async def get_file_dependencies(upload_id: str, file_path: str) -> Dict:
     
     try:
         # Build graph if not cached
-        if upload_id not in _graph_cache:
-            builder = DependencyGraphBuilder(upload_dir)
-            graph_data = builder.build_graph(upload_id)
-            _graph_cache[upload_id] = graph_data
-        else:
-            # Rebuild builder from cache for file query
-            builder = DependencyGraphBuilder(upload_dir)
-            builder.build_graph(upload_id)
+        builder, _ = _build_or_get(upload_id, upload_dir)
         
         file_deps = builder.get_file_dependencies(file_path)
         return file_deps
@@ -90,8 +100,9 @@ async def get_file_dependencies(upload_id: str, file_path: str) -> Dict:
 @router.delete("/graph/{upload_id}/cache")
 async def clear_graph_cache(upload_id: str) -> Dict:
     """Clear cached graph for an upload."""
-    if upload_id in _graph_cache:
-        del _graph_cache[upload_id]
+    graph_cache = _get_graph_cache()
+    if graph_cache.get_stale(upload_id) is not None:
+        del graph_cache[upload_id]
         return {"status": "success", "message": f"Cache cleared for {upload_id}"}
     else:
         return {"status": "info", "message": f"No cache found for {upload_id}"}
@@ -7,7 +7,7 @@ from datetime import datetime
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel
 
-from app.config import settings
+from app.config import get_settings
 from utils.logger import setup_logger
 
 router = APIRouter()
@@ -50,6 +50,8 @@ async def query_codebase(upload_id: str, request: QueryRequest):
     """
     logger.info(f"Query for {upload_id}: {request.question}")
     
+    settings = get_settings()
+    
     # Check if AI is available
     if not settings.ai_available:
         raise HTTPException(
@@ -7,15 +7,24 @@ CRITICAL FIXES:
 - Embedding persistence
 """
 import ast
-import json
+import os
+import hashlib
+import asyncio
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Literal, Optional, Tuple
 from datetime import datetime
 
+import anyio
+import orjson
 from fastapi import APIRouter, HTTPException, status, Query
 from pydantic import BaseModel
 
-from app.config import settings
+from app.config import get_settings
+from app.services.ast_walk import iter_statements
+from app.services.process_pool import pool_size, process_map
+from app.services.upload_meta import is_excluded_dir
+from utils.cache import prune_cache_dir, touch_cache_entry
 from utils.logger import setup_logger
 
 router = APIRouter()
@@ -43,6 +52,92 @@ class SummaryResponse(BaseModel):
     embeddings_stored: bool = False
 
 
+# Bump when template summaries change, so cached ones are recomputed
+SUMMARY_CACHE_VERSION = 2
+TEMPLATE_CACHE_FILENAME = f'template_cache.v{SUMMARY_CACHE_VERSION}.json'
+CONTENT_CACHE_DIRNAME = 'content_cache'
+# Content-addressed summaries kept on disk; the least recently used are pruned beyond this
+CONTENT_CACHE_MAX_ENTRIES = 20_000
+
+
+def _read_code_head(filepath: Path, max_chars: int) -> str:
+    """Read up to max_chars of a source file (blocking)."""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return f.read(max_chars)
+
+
+# Gemini model, configured on first AI summary (the SDK is an optional dependency)
+_genai_model = None
+
+
+def _get_model():
+    """Return the shared Gemini model, importing and configuring the SDK once."""
+    global _genai_model
+    if _genai_model is None:
+        import google.generativeai as genai
+        
+        # Configure Gemini
+        genai.configure(api_key=get_settings().gemini_api_key)
+        # Use gemini-2.0-flash (gemini-1.5-flash is deprecated)
+        _genai_model = genai.GenerativeModel('gemini-2.0-flash')
+    return _genai_model
+
+AI_PROMPT_TEMPLATE = """
+Analyze this Python code and provide a concise 2-3 sentence summary:
+
+Code Preview:
+```python
+{code}
+```
+
+Detected Structure:
+- Classes: {classes}
+- Functions: {functions}
+- Imports: {imports}
+
+Provide:
+1. High-level purpose of this file
+2. Key functionality and responsibilities
+"""
+
+# Prefilter limits for _skip_reason
+SNIFF_CHARS = 64 * 1024
+SNIFF_LINES = 100
+MAX_SOURCE_LINE_LENGTH = 10000
+
+
+def _skip_reason(code: str, lines: List[str]) -> Optional[str]:
+    """
+    Return why a file isn't worth an AST parse ('binary' or 'minified'), or None.
+    Everything else is parsed, so syntax errors are always reported.
+    """
+    if '\x00' in code[:SNIFF_CHARS]:
+        return 'binary'
+    if any(len(line) > MAX_SOURCE_LINE_LENGTH for line in lines[:SNIFF_LINES]):
+        return 'minified'
+    return None
+
+
+def _collect_imports_and_classes(tree: ast.AST) -> Tuple[List[str], List[Dict]]:
+    """Collect imports and classes in a single pass over the tree's statements."""
+    imports: List[str] = []
+    classes: List[Dict] = []
+    for node in iter_statements(tree):
+        node_type = type(node)
+        if node_type is ast.Import:
+            imports.extend(alias.name for alias in node.names)
+        elif node_type is ast.ImportFrom:
+            module = node.module or ''
+            imports.extend(f"{module}.{alias.name}" for alias in node.names)
+        elif node_type is ast.ClassDef:
+            classes.append({
+                "name": node.name,
+                "methods": [item.name for item in node.body if isinstance(item, ast.FunctionDef)],
+                "docstring": ast.get_docstring(node) or ""
+            })
+    return imports, classes
+
+
 class CodeSummarizer:
     """
     Template-based code summarization with robust error handling.
@@ -50,13 +145,17 @@ class CodeSummarizer:
     """
     
     def __init__(self):
+        settings = get_settings()
         self.upload_dir = settings.get_absolute_path(settings.upload_dir)
+        # Created on first write, not here
         self.summaries_dir = settings.get_absolute_path(settings.summaries_dir)
-        self.summaries_dir.mkdir(parents=True, exist_ok=True)
+        # Template summaries keyed by content hash, shared across uploads
+        self.content_cache_dir = self.summaries_dir / CONTENT_CACHE_DIRNAME
     
-    def summarize_file(self, filepath: Path, mode: str = 'template') -> FileSummary:
+    def summarize_file(self, filepath: Path) -> FileSummary:
         """
-        Summarize a single file with error recovery.
+        Template-summarize a single file with error recovery.
+        AI summaries are added separately with `add_ai_summary`.
         """
         parse_errors = []
         
@@ -75,22 +174,24 @@ class CodeSummarizer:
             }
             parse_errors.append(f"Template parsing error: {str(e)}")
         
-        # AI summary (only if available and requested)
-        ai_summary = None
-        if mode in ['ai', 'hybrid'] and settings.ai_available:
-            try:
-                ai_summary = self._ai_summary(filepath, template_summary)
-            except Exception as e:
-                logger.warning(f"AI summary failed for {filepath}: {e}")
-                parse_errors.append(f"AI summary error: {str(e)}")
-        
         return FileSummary(
             filepath=str(filepath),
             template_summary=template_summary,
-            ai_summary=ai_summary,
             parse_errors=parse_errors
         )
     
+    async def add_ai_summary(self, summary: FileSummary):
+        """Add an AI summary to a file summary (only if AI is available)."""
+        if not get_settings().ai_available:
+            return
+        
+        filepath = Path(summary.filepath)
+        try:
+            summary.ai_summary = await self._ai_summary(filepath, summary.template_summary)
+        except Exception as e:
+            logger.warning(f"AI summary failed for {filepath}: {e}")
+            summary.parse_errors.append(f"AI summary error: {str(e)}")
+    
     def _template_summary(self, filepath: Path) -> dict:
         """
         Generate template-based summary using AST.
@@ -103,6 +204,35 @@ class CodeSummarizer:
             logger.error(f"Could not read file {filepath}: {e}")
             raise ValueError(f"Cannot read file: {str(e)}")
         
+        # Identical content (e.g. across re-uploads or forks) gives an identical summary
+        content_hash = hashlib.blake2b(code.encode('utf-8'), digest_size=16).hexdigest()
+        digest = f"v{SUMMARY_CACHE_VERSION}-{content_hash}"
+        cached = self._load_content_summary(digest)
+        if cached is not None:
+            return {"filepath": str(filepath), **cached}
+        
+        summary = self._summarize_code(filepath, code)
+        self._store_content_summary(digest, {k: v for k, v in summary.items() if k != 'filepath'})
+        return summary
+    
+    def _summarize_code(self, filepath: Path, code: str) -> dict:
+        """Summarize already-read source code."""
+        lines = code.splitlines()
+        line_count = len(lines)
+        
+        # Cheap checks first: generated or non-source files aren't worth an AST parse
+        skip_reason = _skip_reason(code, lines)
+        if skip_reason:
+            logger.debug(f"Skipping AST parse of {filepath}: {skip_reason}")
+            return {
+                "filepath": str(filepath),
+                "imports": [],
+                "classes": [],
+                "functions": [],
+                "line_count": line_count,
+                "skipped": skip_reason
+            }
+        
         # Parse with error handling
         try:
             tree = ast.parse(code)
@@ -114,7 +244,7 @@ class CodeSummarizer:
                 "imports": [],
                 "classes": [],
                 "functions": [],
-                "line_count": len(code.splitlines()),
+                "line_count": line_count,
                 "syntax_error": {
                     "line": e.lineno,
                     "message": str(e)
@@ -126,61 +256,18 @@ class CodeSummarizer:
         
         # Extract information safely
         try:
+            imports, classes = _collect_imports_and_classes(tree)
             return {
                 "filepath": str(filepath),
-                "imports": self._safe_extract_imports(tree),
-                "classes": self._safe_extract_classes(tree),
+                "imports": imports,
+                "classes": classes,
                 "functions": self._safe_extract_functions(tree),
-                "line_count": len(code.splitlines())
+                "line_count": line_count
             }
         except Exception as e:
             logger.error(f"Error extracting info from {filepath}: {e}")
             raise ValueError(f"Extraction error: {str(e)}")
     
-    def _safe_extract_imports(self, tree: ast.AST) -> List[str]:
-        """Extract imports with error handling."""
-        imports = []
-        try:
-            for node in ast.walk(tree):
-                try:
-                    if isinstance(node, ast.Import):
-                        imports.extend(alias.name for alias in node.names)
-                    elif isinstance(node, ast.ImportFrom):
-                        module = node.module or ''
-                        imports.extend(f"{module}.{alias.name}" for alias in node.names)
-                except Exception as e:
-                    logger.debug(f"Error extracting import: {e}")
-                    continue
-        except Exception as e:
-            logger.warning(f"Error walking AST for imports: {e}")
-        
-        return imports
-    
-    def _safe_extract_classes(self, tree: ast.AST) -> List[Dict]:
-        """Extract classes with error handling."""
-        classes = []
-        try:
-            for node in ast.walk(tree):
-                try:
-                    if isinstance(node, ast.ClassDef):
-                        methods = []
-                        for item in node.body:
-                            if isinstance(item, ast.FunctionDef):
-                                methods.append(item.name)
-                        
-                        classes.append({
-                            "name": node.name,
-                            "methods": methods,
-                            "docstring": ast.get_docstring(node) or ""
-                        })
-                except Exception as e:
-                    logger.debug(f"Error extracting class: {e}")
-                    continue
-        except Exception as e:
-            logger.warning(f"Error walking AST for classes: {e}")
-        
-        return classes
-    
     def _safe_extract_functions(self, tree: ast.AST) -> List[Dict]:
         """Extract top-level functions with error handling."""
         functions = []
@@ -205,31 +292,26 @@ class CodeSummarizer:
         
         return functions
     
-    def _ai_summary(self, filepath: Path, template_summary: dict) -> Optional[str]:
+    async def _ai_summary(self, filepath: Path, template_summary: dict) -> Optional[str]:
         """
         Generate AI-powered summary using Google Gemini.
         Only called if AI is available.
         """
-        if not settings.ai_available:
+        if not get_settings().ai_available:
             return None
         
         try:
-            import google.generativeai as genai
+            model = _get_model()
             
-            # Configure Gemini
-            genai.configure(api_key=settings.gemini_api_key)
-            # Use gemini-2.0-flash (gemini-1.5-flash is deprecated)
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            
-            # Read file content (truncate if too large)
-            with open(filepath, 'r', encoding='utf-8') as f:
-                code = f.read()[:8000]  # Gemini can handle more context
+            # Read file content (truncate if too large) in a thread, so the
+            # concurrently gathered requests don't block the event loop on disk
+            code = await anyio.to_thread.run_sync(_read_code_head, filepath, 8000)  # Gemini can handle more context
             
             # Build prompt
             prompt = self._build_prompt(code, template_summary)
             
             # Call Gemini
-            response = model.generate_content(
+            response = await model.generate_content_async(
                 prompt,
                 generation_config={
                     'temperature': 0.3,
@@ -243,28 +325,73 @@ class CodeSummarizer:
             logger.error(f"Google Gemini API error: {e}")
             return None
     
+    def _load_content_summary(self, digest: str) -> Optional[dict]:
+        """Return the cached template summary (without filepath) for a content digest."""
+        cache_file = self.content_cache_dir / f"{digest}.json"
+        try:
+            summary = orjson.loads(cache_file.read_bytes())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug(f"Ignoring unreadable content cache entry {digest}: {e}")
+            return None
+        touch_cache_entry(cache_file)
+        return summary
+    
+    def _store_content_summary(self, digest: str, summary: dict):
+        """Cache a template summary by content digest (atomic, safe across worker processes)."""
+        cache_file = self.content_cache_dir / f"{digest}.json"
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            # Created on first store; scheduled cleanup may also remove it
+            self.content_cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_file.write_bytes(orjson.dumps(summary))
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logger.debug(f"Error saving content cache entry {digest}: {e}")
+    
+    def prune_content_cache(self):
+        """Drop the least recently used content cache entries beyond CONTENT_CACHE_MAX_ENTRIES."""
+        removed = prune_cache_dir(self.content_cache_dir, max_entries=CONTENT_CACHE_MAX_ENTRIES)
+        if removed:
+            logger.info(f"Pruned {removed} content cache entries")
+    
     def _build_prompt(self, code: str, template_summary: dict) -> str:
         """Build prompt for AI summarization."""
-        classes = [c['name'] for c in template_summary.get('classes', [])]
-        functions = [f['name'] for f in template_summary.get('functions', [])]
+        return AI_PROMPT_TEMPLATE.format(
+            code=code,
+            classes=', '.join(c['name'] for c in template_summary.get('classes', ())) or 'None',
+            functions=', '.join(f['name'] for f in template_summary.get('functions', ())) or 'None',
+            imports=', '.join(template_summary.get('imports', ())[:5])
+        )
+    
+    def load_template_cache(self, upload_id: str) -> Dict[str, Dict]:
+        """
+        Load cached template summaries for an upload.
+        Maps filepath -> {"stamp": [mtime_ns, size], "summary": FileSummary dict}.
+        """
+        cache_file = self.summaries_dir / upload_id / TEMPLATE_CACHE_FILENAME
+        try:
+            return orjson.loads(cache_file.read_bytes())
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable template cache {cache_file}: {e}")
+            return {}
+    
+    def save_template_cache(self, upload_id: str, cache: Dict[str, Dict]):
+        """Atomically persist the template summary cache for an upload."""
+        output_dir = self.summaries_dir / upload_id
+        output_dir.mkdir(parents=True, exist_ok=True)
         
-        return f"""
-Analyze this Python code and provide a concise 2-3 sentence summary:
-
-Code Preview:
-```python
-{code}
-```
-
-Detected Structure:
-- Classes: {', '.join(classes) if classes else 'None'}
-- Functions: {', '.join(functions) if functions else 'None'}
-- Imports: {', '.join(template_summary.get('imports', [])[:5])}
-
-Provide:
-1. High-level purpose of this file
-2. Key functionality and responsibilities
-"""
+        cache_file = output_dir / TEMPLATE_CACHE_FILENAME
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        
+        try:
+            tmp_file.write_bytes(orjson.dumps(cache))
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logger.warning(f"Error saving template cache: {e}")
     
     def save_summaries(self, upload_id: str, summaries: List[FileSummary]):
         """Persist summaries to disk."""
@@ -278,11 +405,10 @@ Provide:
                 "upload_id": upload_id,
                 "summarized_at": datetime.utcnow().isoformat(),
                 "total_files": len(summaries),
-                "files": [s.dict() for s in summaries]
+                "files": [s.model_dump() for s in summaries]
             }
             
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2)
+            output_file.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
             
             logger.info(f"Saved summaries for {upload_id} to {output_file}")
         
@@ -291,14 +417,111 @@ Provide:
             raise
 
 
-# Initialize summarizer
-summarizer = CodeSummarizer()
+@lru_cache(maxsize=1)
+def get_summarizer() -> CodeSummarizer:
+    """Return the shared summarizer (one per process, worker processes included)."""
+    return CodeSummarizer()
+
+# Max files handed to each worker process at a time
+SUMMARY_CHUNK_SIZE = 8
+# Max Gemini requests in flight per summarization
+AI_CONCURRENCY = 16
+
+
+def _iter_py_files(root: str) -> Iterator[str]:
+    """Yield paths of .py files under root, skipping excluded directories."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not is_excluded_dir(entry.name):
+                            stack.append(entry.path)
+                    elif entry.name.endswith('.py'):
+                        yield entry.path
+        except OSError as e:
+            logger.warning(f"Error reading directory while finding Python files: {e}")
+
+
+def _summarize_one(path_str: str) -> FileSummary:
+    """
+    Summarize one file in a worker process.
+    Never raises, so one bad file can't take down the whole batch.
+    """
+    try:
+        return get_summarizer().summarize_file(Path(path_str))
+    except Exception as e:
+        logger.error(f"Failed to summarize {path_str}: {e}")
+        return FileSummary(
+            filepath=path_str,
+            template_summary={"error": str(e)},
+            parse_errors=[f"Critical error: {str(e)}"]
+        )
+
+
+def _summarize_all(paths: List[str]) -> List[FileSummary]:
+    """Summarize files in parallel across the shared worker pool (AST parsing is CPU bound)."""
+    max_workers = min(len(paths), pool_size())
+    if max_workers <= 1:
+        return [_summarize_one(path) for path in paths]
+    
+    # Smaller chunks for small uploads so every worker gets some files
+    chunksize = max(1, min(SUMMARY_CHUNK_SIZE, len(paths) // max_workers))
+    return process_map(_summarize_one, paths, chunksize=chunksize)
+
+
+def _summarize_with_cache(upload_id: str, paths: List[str]) -> List[FileSummary]:
+    """
+    Template-summarize files, reusing summaries for files whose
+    (mtime, size) haven't changed since the last run.
+    """
+    summarizer = get_summarizer()
+    cache = summarizer.load_template_cache(upload_id)
+    new_cache: Dict[str, Dict] = {}
+    summaries: List[Optional[FileSummary]] = [None] * len(paths)
+    stamps: Dict[str, List[int]] = {}
+    misses = []
+    
+    for i, path in enumerate(paths):
+        try:
+            st = os.stat(path)
+            stamp = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            stamp = None
+        
+        entry = cache.get(path)
+        if stamp is not None and entry is not None and entry['stamp'] == stamp:
+            summaries[i] = FileSummary(**entry['summary'])
+            new_cache[path] = entry
+        else:
+            misses.append(i)
+            if stamp is not None:
+                stamps[path] = stamp
+    
+    if misses:
+        results = _summarize_all([paths[i] for i in misses])
+        for i, summary in zip(misses, results):
+            summaries[i] = summary
+            path = paths[i]
+            # Read failures may be transient, so only cache real summaries
+            if path in stamps and "error" not in summary.template_summary:
+                new_cache[path] = {"stamp": stamps[path], "summary": summary.model_dump()}
+    
+    if misses or len(new_cache) != len(cache):
+        summarizer.save_template_cache(upload_id, new_cache)
+    if misses:
+        # Once per batch rather than per entry written by the workers
+        summarizer.prune_content_cache()
+    
+    logger.info(f"Template cache: {len(paths) - len(misses)} hits, {len(misses)} misses")
+    return summaries
 
 
 @router.post("/{upload_id}", response_model=SummaryResponse)
 async def summarize_codebase(
     upload_id: str,
-    mode: str = Query('template', regex='^(template|ai|hybrid)$', description="Summarization mode")
+    mode: Literal['template', 'ai', 'hybrid'] = Query('template', description="Summarization mode")
 ):
     """
     Generate summaries for all files in an upload.
@@ -312,6 +535,8 @@ async def summarize_codebase(
     """
     logger.info(f"Summarizing upload {upload_id} with mode={mode}")
     
+    summarizer = get_summarizer()
+    
     # Check if upload exists
     upload_dir = summarizer.upload_dir / upload_id
     if not upload_dir.exists():
@@ -321,12 +546,13 @@ async def summarize_codebase(
         )
     
     # Warn if AI requested but not available
-    if mode in ['ai', 'hybrid'] and not settings.ai_available:
+    if mode in ['ai', 'hybrid'] and not get_settings().ai_available:
         logger.warning(f"AI mode requested but not available, falling back to template")
         mode = 'template'
     
     # Find all Python files
-    python_files = list(upload_dir.rglob('*.py'))
+    loop = asyncio.get_running_loop()
+    python_files = await loop.run_in_executor(None, lambda: list(_iter_py_files(str(upload_dir))))
     logger.info(f"Found {len(python_files)} Python files to summarize")
     
     if not python_files:
@@ -335,30 +561,24 @@ async def summarize_codebase(
             detail="No Python files found in upload"
         )
     
-    # Summarize each file
-    summaries = []
-    successful_count = 0
+    # Template-summarize files off the event loop
+    summaries = await loop.run_in_executor(None, _summarize_with_cache, upload_id, python_files)
     
-    for py_file in python_files:
-        try:
-            summary = summarizer.summarize_file(py_file, mode=mode)
-            summaries.append(summary)
-            
-            if not summary.parse_errors:
-                successful_count += 1
+    # AI summaries are network bound, so run them concurrently
+    if mode in ['ai', 'hybrid']:
+        semaphore = asyncio.Semaphore(AI_CONCURRENCY)
         
-        except Exception as e:
-            logger.error(f"Failed to summarize {py_file}: {e}")
-            # Continue with other files - don't crash on one bad file
-            summaries.append(FileSummary(
-                filepath=str(py_file),
-                template_summary={"error": str(e)},
-                parse_errors=[f"Critical error: {str(e)}"]
-            ))
+        async def _add_ai_summary(summary: FileSummary):
+            async with semaphore:
+                await summarizer.add_ai_summary(summary)
+        
+        await asyncio.gather(*(_add_ai_summary(summary) for summary in summaries))
+    
+    successful_count = sum(1 for summary in summaries if not summary.parse_errors)
     
     # Save summaries
     try:
-        summarizer.save_summaries(upload_id, summaries)
+        await loop.run_in_executor(None, summarizer.save_summaries, upload_id, summaries)
     except Exception as e:
         logger.error(f"Failed to save summaries: {e}")
         # Don't fail the request, summaries are already generated
@@ -380,7 +600,7 @@ async def get_summaries(upload_id: str):
     """
     Retrieve previously generated summaries.
     """
-    summary_file = summarizer.summaries_dir / upload_id / 'file_summaries.json'
+    summary_file = get_summarizer().summaries_dir / upload_id / 'file_summaries.json'
     
     if not summary_file.exists():
         raise HTTPException(
@@ -389,8 +609,7 @@ async def get_summaries(upload_id: str):
         )
     
     try:
-        with open(summary_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = orjson.loads(summary_file.read_bytes())
         
         return SummaryResponse(
             upload_id=data['upload_id'],
@@ -6,22 +6,42 @@ CRITICAL FIXES:
 - Race condition prevention with unique IDs
 - Disk space checks
 """
+import os
 import uuid
+import asyncio
+import hashlib
 import zipfile
 import shutil
 from pathlib import Path
-from typing import Optional
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import BinaryIO, Optional, Union
 from datetime import datetime
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, status
 from pydantic import BaseModel
 
-from app.config import settings
+from app.config import get_settings
+from app.routes import files
+from app.services.upload_meta import (
+    EXCLUDE_DIRS,
+    META_FILENAME,
+    find_upload_by_digest,
+    read_upload_meta,
+    record_upload_digest,
+    write_upload_meta,
+)
 from utils.logger import setup_logger
 
 router = APIRouter()
 logger = setup_logger(__name__)
 
+HASH_CHUNK_SIZE = 64 * 1024
+# Uploads up to this size are extracted from the request's spooled file instead of a temp copy
+IN_MEMORY_ZIP_MAX_SIZE = 5 * 1024 * 1024
+# Cap on total extracted bytes, as a multiple of the max upload size
+MAX_EXTRACTION_RATIO = 20
+
 
 class UploadResponse(BaseModel):
     """Upload response model."""
@@ -38,58 +58,77 @@ class FileHandler:
     """Handles file upload, validation, and extraction."""
     
     def __init__(self):
+        settings = get_settings()
         self.upload_dir = settings.get_absolute_path(settings.upload_dir)
+        # Created when the first large upload is spooled to disk
         self.temp_dir = self.upload_dir / 'temp'
         self.max_size = settings.max_file_size_bytes
-        
-        # Ensure directories exist
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.max_extracted_size = settings.max_file_size_bytes * MAX_EXTRACTION_RATIO
     
     async def validate_file(self, file: UploadFile) -> tuple[bool, Optional[str]]:
         """
         Validate uploaded file.
+        Size is checked while streaming in `save_upload`.
         Returns (is_valid, error_message)
         """
         # Check file extension
         if not file.filename.endswith('.zip'):
             return False, "Only .zip files are allowed"
         
-        # Check file size (read first chunk to get size)
-        file.file.seek(0, 2)  # Seek to end
-        file_size = file.file.tell()
-        file.file.seek(0)  # Reset to beginning
-        
-        if file_size > self.max_size:
-            max_mb = self.max_size / (1024 * 1024)
-            return False, f"File size exceeds {max_mb}MB limit"
-        
-        if file_size == 0:
-            return False, "File is empty"
-        
         return True, None
     
-    async def save_upload(self, file: UploadFile) -> tuple[str, Path, int]:
+    async def save_upload(self, file: UploadFile) -> tuple[str, Optional[Path], int, str]:
         """
-        Save uploaded file to temp directory.
-        Returns (upload_id, temp_file_path, file_size)
+        Save uploaded file to temp directory, enforcing the size limit and
+        hashing the content in the same pass.
+        Small uploads are only hashed: they are extracted straight from the
+        in-memory upload and temp_file_path is None.
+        Returns (upload_id, temp_file_path, file_size, sha256)
         """
         upload_id = str(uuid.uuid4())
-        temp_file_path = self.temp_dir / f"{upload_id}.zip"
+        in_memory = file.size is not None and file.size <= IN_MEMORY_ZIP_MAX_SIZE
+        temp_file_path = None if in_memory else self.temp_dir / f"{upload_id}.zip"
         
         try:
             # Save file in chunks to handle large files
             file_size = 0
-            with open(temp_file_path, 'wb') as buffer:
+            sha256 = hashlib.sha256()
+            if temp_file_path:
+                self.temp_dir.mkdir(parents=True, exist_ok=True)
+            with (open(temp_file_path, 'wb') if temp_file_path else nullcontext()) as buffer:
                 while chunk := await file.read(1024 * 1024):  # 1MB chunks
-                    buffer.write(chunk)
                     file_size += len(chunk)
+                    if file_size > self.max_size:
+                        max_mb = self.max_size / (1024 * 1024)
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"File size exceeds {max_mb}MB limit"
+                        )
+                    sha256.update(chunk)
+                    if buffer:
+                        buffer.write(chunk)
+            
+            if file_size == 0:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="File is empty"
+                )
+            
+            if in_memory:
+                await file.seek(0)
             
             logger.info(f"Saved upload {upload_id}: {file_size} bytes")
-            return upload_id, temp_file_path, file_size
+            return upload_id, temp_file_path, file_size, sha256.hexdigest()
+        
+        except HTTPException as e:
+            if temp_file_path and temp_file_path.exists():
+                temp_file_path.unlink()
+            logger.warning(f"Validation failed: {e.detail}")
+            raise
         
         except Exception as e:
             # Cleanup on error
-            if temp_file_path.exists():
+            if temp_file_path and temp_file_path.exists():
                 temp_file_path.unlink()
             logger.error(f"Error saving upload: {e}")
             raise HTTPException(
@@ -97,32 +136,56 @@ class FileHandler:
                 detail=f"Failed to save upload: {str(e)}"
             )
     
-    def extract_zip(self, zip_path: Path, upload_id: str) -> Path:
+    def extract_zip(self, zip_source: Union[Path, BinaryIO], upload_id: str) -> Path:
         """
-        Extract ZIP file preserving directory structure.
+        Extract ZIP file (a path or a seekable file object) preserving directory structure.
         Returns path to extracted directory.
         """
         extract_path = self.upload_dir / upload_id
         
         try:
-            # Validate ZIP file
-            if not zipfile.is_zipfile(zip_path):
-                raise ValueError("Invalid ZIP file")
-            
-            # Extract with safety checks
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                # Check for path traversal attacks
-                for member in zip_ref.namelist():
+            # Single pass over the archive: validate, filter and extract each member
+            with zipfile.ZipFile(zip_source, 'r') as zip_ref:
+                content_hashes = {}
+                budget = self.max_extracted_size
+                
+                for info in zip_ref.infolist():
+                    member = info.filename
+                    
+                    # Check for path traversal attacks
                     if member.startswith('/') or '..' in member:
                         raise ValueError(f"Unsafe file path in ZIP: {member}")
-                
-                # Extract
-                zip_ref.extractall(extract_path)
+                    
+                    # Nothing downstream reads vendored or generated directories
+                    if not EXCLUDE_DIRS.isdisjoint(member.split('/')[:-1]):
+                        continue
+                    
+                    if info.is_dir():
+                        (extract_path / member).mkdir(parents=True, exist_ok=True)
+                        continue
+                    
+                    # Guard against ZIP bombs using the declared size first...
+                    if info.file_size > budget:
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"ZIP contents exceed {self.max_extracted_size // (1024 * 1024)}MB when extracted"
+                        )
+                    
+                    # ...and the bytes actually written, in case the header lies
+                    content_hashes[member], written = self._extract_member(zip_ref, info, extract_path, budget)
+                    budget -= written
             
+            write_upload_meta(extract_path, content_hashes)
             logger.info(f"Extracted {upload_id} to {extract_path}")
             return extract_path
         
+        except HTTPException:
+            if extract_path.exists():
+                shutil.rmtree(extract_path, ignore_errors=True)
+            raise
         except zipfile.BadZipFile:
+            if extract_path.exists():
+                shutil.rmtree(extract_path, ignore_errors=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Corrupted ZIP file"
@@ -137,18 +200,99 @@ class FileHandler:
                 detail=f"Failed to extract ZIP: {str(e)}"
             )
     
-    def cleanup_temp(self, temp_path: Path):
-        """Remove temporary file."""
+    def _extract_member(self, zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, extract_path: Path, budget: int) -> tuple[str, int]:
+        """
+        Write a single ZIP member to disk.
+        Returns (SHA256, bytes written); stops once more than `budget` bytes are written.
+        """
+        target = extract_path / info.filename
+        target.parent.mkdir(parents=True, exist_ok=True)
+        
+        sha256 = hashlib.sha256()
+        written = 0
+        with zip_ref.open(info) as src, open(target, 'wb') as dst:
+            while chunk := src.read(HASH_CHUNK_SIZE):
+                written += len(chunk)
+                if written > budget:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"ZIP contents exceed {self.max_extracted_size // (1024 * 1024)}MB when extracted"
+                    )
+                sha256.update(chunk)
+                dst.write(chunk)
+        
+        return sha256.hexdigest(), written
+    
+    def clone_upload(self, source_id: str, upload_id: str) -> Path:
+        """
+        Materialize an identical earlier upload under a new upload_id by hard-linking
+        its extracted files (copying where links aren't supported).
+        The new upload gets its own directory, mtime and sidecar, so deleting or
+        expiring either upload never affects the other; only the extraction is shared.
+        """
+        source_path = self.upload_dir / source_id
+        extract_path = self.upload_dir / upload_id
+        content_hashes = (read_upload_meta(source_path) or {}).get('content_hashes')
+        
+        try:
+            shutil.copytree(
+                source_path,
+                extract_path,
+                ignore=shutil.ignore_patterns(META_FILENAME),
+                copy_function=_link_or_copy
+            )
+        except Exception:
+            shutil.rmtree(extract_path, ignore_errors=True)
+            raise
+        
+        write_upload_meta(extract_path, content_hashes)
+        logger.info(f"Linked {upload_id} to identical upload {source_id}")
+        return extract_path
+    
+    def materialize(self, zip_source: Union[Path, BinaryIO], upload_id: str, digest: str) -> tuple[Path, bool]:
+        """
+        Extract an upload, reusing an identical earlier upload's files when one exists.
+        Blocking; runs off the event loop. Returns (extracted path, reused).
+        """
+        reused = False
+        existing_id = find_upload_by_digest(self.upload_dir, digest)
+        if existing_id:
+            try:
+                extract_path = self.clone_upload(existing_id, upload_id)
+                reused = True
+            except Exception as e:
+                # E.g. the earlier upload was deleted mid-copy; just extract
+                logger.warning(f"Could not reuse upload {existing_id}, extracting instead: {e}")
+        
+        if not reused:
+            extract_path = self.extract_zip(zip_source, upload_id)
+        
+        # Point the digest at the newest copy, which will be the last to expire
+        record_upload_digest(self.upload_dir, digest, upload_id)
+        return extract_path, reused
+    
+    def cleanup_temp(self, temp_path: Optional[Path]):
+        """Remove temporary file (None for uploads extracted from memory)."""
         try:
-            if temp_path.exists():
+            if temp_path and temp_path.exists():
                 temp_path.unlink()
                 logger.debug(f"Cleaned up temp file: {temp_path}")
         except Exception as e:
             logger.warning(f"Failed to cleanup temp file: {e}")
 
 
-# Initialize file handler
-file_handler = FileHandler()
+def _link_or_copy(src: str, dst: str):
+    """copytree copy_function: hard link, falling back to a copy across filesystems."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+@lru_cache(maxsize=1)
+def get_file_handler() -> FileHandler:
+    """Return the shared file handler."""
+    return FileHandler()
 
 
 @router.post("", response_model=UploadResponse, status_code=status.HTTP_201_CREATED)
@@ -161,6 +305,7 @@ async def upload_codebase(file: UploadFile = File(...)):
     Returns upload metadata and extraction status.
     """
     logger.info(f"Received upload request: {file.filename}")
+    file_handler = get_file_handler()
     
     # Validate file
     is_valid, error_msg = await file_handler.validate_file(file)
@@ -176,10 +321,16 @@ async def upload_codebase(file: UploadFile = File(...)):
     
     try:
         # Save upload
-        upload_id, temp_file_path, file_size = await file_handler.save_upload(file)
+        upload_id, temp_file_path, file_size, digest = await file_handler.save_upload(file)
         
-        # Extract ZIP
-        extract_path = file_handler.extract_zip(temp_file_path, upload_id)
+        # Extract ZIP off the event loop so other requests keep being served;
+        # identical ZIPs link to an earlier upload's files instead
+        loop = asyncio.get_running_loop()
+        zip_source = temp_file_path or file.file
+        extract_path, reused = await loop.run_in_executor(
+            None, file_handler.materialize, zip_source, upload_id, digest
+        )
+        files.invalidate(upload_id)
         
         # Cleanup temp file
         file_handler.cleanup_temp(temp_file_path)
@@ -193,11 +344,16 @@ async def upload_codebase(file: UploadFile = File(...)):
             extracted_to=str(extract_path),
             status="success",
             timestamp=datetime.utcnow().isoformat(),
-            message="Upload and extraction completed successfully"
+            message=(
+                "Identical upload already extracted, reusing its files" if reused
+                else "Upload and extraction completed successfully"
+            )
         )
     
     except HTTPException:
-        # Re-raise HTTP exceptions
+        # Re-raise HTTP exceptions (e.g. a rejected ZIP) once the temp file is gone
+        if temp_file_path and temp_file_path.exists():
+            file_handler.cleanup_temp(temp_file_path)
         raise
     
     except Exception as e:
@@ -231,6 +387,7 @@ async def delete_upload(upload_id: str):
         )
     
     success = cleanup_manager.cleanup_specific_upload(upload_id)
+    files.invalidate(upload_id)
     
     if success:
         return {
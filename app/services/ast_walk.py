@@ -0,0 +1,31 @@
+"""
+Statement-level AST traversal shared by the summarizer, metadata builder and
+dependency graph. Definitions and imports are statements, and expressions
+can't contain statements, so walking only statement blocks finds all of them
+without visiting the (far more numerous) expression nodes.
+"""
+import ast
+from typing import Iterator
+
+# Fields holding statement lists (try handlers and match cases included)
+STATEMENT_FIELDS = ('body', 'handlers', 'orelse', 'finalbody', 'cases')
+
+
+def iter_statements(tree: ast.AST) -> Iterator[ast.AST]:
+    """
+    Yield every statement under `tree` in source order (parents before their
+    bodies), using an explicit stack rather than recursion.
+    Except handlers and match cases are yielded too, as the blocks that hold statements.
+    """
+    stack = []
+    node = tree
+    while True:
+        # Push children in reverse so they pop in source order
+        for field in reversed(STATEMENT_FIELDS):
+            children = getattr(node, field, None)
+            if children:
+                stack.extend(reversed(children))
+        if not stack:
+            return
+        node = stack.pop()
+        yield node
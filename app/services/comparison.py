@@ -2,7 +2,11 @@
 Codebase comparison utilities for multi-project analysis.
 Compares file structures, dependencies, and summaries across codebases.
 """
+import os
 import hashlib
+import sqlite3
+import threading
+import time
 from typing import List, Dict, Set, Tuple, Optional
 from pathlib import Path
 from datetime import datetime
@@ -17,6 +21,9 @@ from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Read buffer for hashing when hashlib.file_digest isn't available (< 3.11)
+HASH_BUFFER_SIZE = 1024 * 1024
+
 
 class CodebaseComparator:
     """Compare two codebases and identify differences."""
@@ -103,23 +110,30 @@ class CodebaseComparator:
         # Check for modifications in common files
         modified = []
         unchanged = []
+        unhashed = 0
         
         for path in common:
             base_file = base_files[path]
             compare_file = compare_files[path]
             
-            # Compare using hash if available
-            if base_file.content_hash and compare_file.content_hash:
-                if base_file.content_hash != compare_file.content_hash:
-                    modified.append(path)
-                else:
-                    unchanged.append(path)
-            # Fallback to size comparison
-            elif base_file.size_bytes != compare_file.size_bytes:
+            # Different sizes always mean different content, so check the cheap field first
+            if base_file.size_bytes != compare_file.size_bytes:
+                modified.append(path)
+            # Same size: compare the hashes recorded at ingest
+            elif not (base_file.content_hash and compare_file.content_hash):
+                unhashed += 1
+                unchanged.append(path)
+            elif base_file.content_hash != compare_file.content_hash:
                 modified.append(path)
             else:
                 unchanged.append(path)
         
+        if unhashed:
+            logger.warning(
+                f"{unhashed} same-size files have no content hash; "
+                f"treated as unchanged (rebuild metadata to hash them)"
+            )
+        
         logger.info(f"Files: +{len(added)}, -{len(removed)}, ~{len(modified)}, ={len(unchanged)}")
         
         return {
@@ -169,12 +183,12 @@ class CodebaseComparator:
         added_deps = list(compare_packages - base_packages)
         removed_deps = list(base_packages - compare_packages)
         
-        # Compare circular dependencies
-        base_circular = set(tuple(chain) for chain in base_deps.circular_dependencies)
-        compare_circular = set(tuple(chain) for chain in compare_deps.circular_dependencies)
+        # Compare circular dependencies (the same cycle may start at any of its files)
+        base_circular = {_canonical_cycle(chain) for chain in base_deps.circular_dependencies}
+        compare_circular = {_canonical_cycle(chain) for chain in compare_deps.circular_dependencies}
         
-        new_circular = [list(chain) for chain in (compare_circular - base_circular)]
-        resolved_circular = [list(chain) for chain in (base_circular - compare_circular)]
+        new_circular = [list(chain) for chain in sorted(compare_circular - base_circular)]
+        resolved_circular = [list(chain) for chain in sorted(base_circular - compare_circular)]
         
         return {
             'added': sorted(added_deps),
@@ -200,14 +214,13 @@ class CodebaseComparator:
         base_paths = set(f.relative_path for f in self.base_metadata.files)
         compare_paths = set(f.relative_path for f in self.compare_metadata.files)
         
-        common_files = base_paths & compare_paths
-        total_unique = base_paths | compare_paths
+        # Intersect by scanning the smaller set
+        if len(base_paths) > len(compare_paths):
+            base_paths, compare_paths = compare_paths, base_paths
+        common_count = len(base_paths & compare_paths)
         
-        # Jaccard similarity for file sets
-        if len(total_unique) == 0:
-            return 1.0
-        
-        similarity = len(common_files) / len(total_unique)
+        # Jaccard similarity for file sets; |A ∪ B| = |A| + |B| - |A ∩ B|
+        similarity = common_count / (len(base_paths) + len(compare_paths) - common_count)
         
         return round(similarity, 3)
     
@@ -257,15 +270,150 @@ class CodebaseComparator:
         return "; ".join(lines)
 
 
-def compute_file_hash(file_path: Path) -> str:
-    """Compute SHA256 hash of file content."""
-    sha256 = hashlib.sha256()
+def _canonical_cycle(chain: List[str]) -> Tuple[str, ...]:
+    """
+    Rotate a cycle so it starts at its smallest file, so [A, B, C, A] and
+    [B, C, A, B] compare equal. Closed chains (first == last) stay closed.
+    """
+    nodes = list(chain)
+    closed = len(nodes) > 1 and nodes[0] == nodes[-1]
+    if closed:
+        nodes.pop()
+    if not nodes:
+        return tuple(chain)
+    
+    start = nodes.index(min(nodes))
+    rotated = nodes[start:] + nodes[:start]
+    if closed:
+        rotated.append(rotated[0])
+    return tuple(rotated)
+
+
+class _HashCache:
+    """
+    Persistent (path, mtime_ns, size) -> SHA256 memo, so unchanged files
+    are recognised from a stat() instead of being re-read and re-hashed.
+    New entries are buffered in memory and written in one transaction by flush().
+    """
+    
+    # Bump when the table layout changes, so old rows are discarded
+    VERSION = 1
+    MAX_ENTRIES = 100_000
+    
+    def __init__(self, db_file: Path):
+        self.db_file = db_file
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[str, Tuple[int, int, str]] = {}  # path -> (mtime_ns, size, sha256)
+        self._lock = threading.Lock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        # Caller holds the lock
+        if self._conn is None:
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                conn.execute("DROP TABLE IF EXISTS file_hashes")
+                # JSON file used by older versions
+                self.db_file.with_suffix('.json').unlink(missing_ok=True)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, sha256 TEXT, stored_at INTEGER)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS file_hashes_stored_at ON file_hashes (stored_at)")
+            conn.execute(f"PRAGMA user_version = {self.VERSION}")
+            self._conn = conn
+        return self._conn
+    
+    def get(self, path: str, st: os.stat_result) -> Optional[str]:
+        try:
+            with self._lock:
+                entry = self._pending.get(path)
+                if entry is None:
+                    entry = self._connect().execute(
+                        "SELECT mtime_ns, size, sha256 FROM file_hashes WHERE path = ?", (path,)
+                    ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Hash cache unavailable: {e}")
+            return None
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        return None
+    
+    def put(self, path: str, st: os.stat_result, digest: str):
+        with self._lock:
+            self._pending[path] = (st.st_mtime_ns, st.st_size, digest)
+    
+    def flush(self):
+        """Persist new entries (call once after a batch of hashing)."""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            now = int(time.time())
+            try:
+                conn = self._connect()
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?)",
+                    [(path, mtime_ns, size, digest, now)
+                     for path, (mtime_ns, size, digest) in pending.items()]
+                )
+                # Oldest entries first; they mostly belong to deleted uploads
+                excess = conn.execute("SELECT COUNT(*) FROM file_hashes").fetchone()[0] - self.MAX_ENTRIES
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM file_hashes WHERE path IN ("
+                        "SELECT path FROM file_hashes ORDER BY stored_at LIMIT ?)",
+                        (excess,)
+                    )
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to save hash cache: {e}")
+
+
+file_hash_cache = _HashCache(Path("embeddings_cache") / "file_hashes.db")
+
+
+def compute_file_hash(file_path: Path, verify: bool = False) -> str:
+    """
+    Compute SHA256 hash of file content.
+    Unchanged files (same mtime and size) reuse the memoized hash unless
+    `verify` is set. Call `file_hash_cache.flush()` after a batch.
+    """
+    try:
+        st = file_path.stat()
+    except OSError as e:
+        logger.warning(f"Failed to hash {file_path}: {e}")
+        return ""
+    
+    key = str(file_path)
+    if not verify:
+        cached = file_hash_cache.get(key, st)
+        if cached:
+            return cached
     
+    digest = _hash_file(file_path)
+    if digest:
+        file_hash_cache.put(key, st, digest)
+    return digest
+
+
+def _hash_file(file_path: Path) -> str:
+    """Hash file content with SHA256, returning "" if it can't be read."""
     try:
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                sha256.update(chunk)
-        return sha256.hexdigest()
+        with open(file_path, 'rb', buffering=0) as f:
+            if hasattr(hashlib, 'file_digest'):
+                # Python 3.11+: hashes in C with its own buffer, releasing the GIL
+                return hashlib.file_digest(f, 'sha256').hexdigest()
+            
+            sha256 = hashlib.sha256()
+            buf = bytearray(HASH_BUFFER_SIZE)
+            view = memoryview(buf)
+            while n := f.readinto(buf):
+                sha256.update(view[:n])
+            return sha256.hexdigest()
     except Exception as e:
         logger.warning(f"Failed to hash {file_path}: {e}")
         return ""
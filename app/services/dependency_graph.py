@@ -2,15 +2,79 @@
 Dependency Graph Builder for Python Projects
 Analyzes import statements and constructs dependency relationships
 """
+import os
 import ast
+import hashlib
+import heapq
 import logging
+from array import array
 from pathlib import Path
 from typing import Dict, List, Set, Tuple, Optional
-from collections import defaultdict
+from collections import defaultdict, deque
 import json
 
+import orjson
+
+from app.services.ast_walk import iter_statements
+from app.services.comparison import compute_file_hash, file_hash_cache
+from app.services.process_pool import pool_size, process_map
+from app.services.upload_meta import is_excluded_dir, read_upload_meta
+from utils.cache import prune_cache_dir, touch_cache_entry
+
 logger = logging.getLogger(__name__)
 
+# Below this many files a process pool costs more to start than it saves
+PARALLEL_MIN_FILES = 32
+
+# Built graphs keyed by the hash of their .py files, shared across uploads
+GRAPH_CACHE_DIR = Path("embeddings_cache") / "graphs"
+# Graphs kept on disk; the least recently used are pruned beyond this
+GRAPH_CACHE_MAX_ENTRIES = 256
+# Bump when parsing or import resolution changes, so stale graphs aren't reused
+GRAPH_CACHE_VERSION = 1
+
+
+def _collect_imports(tree: ast.AST) -> List[str]:
+    """Imported module names in source order, visiting statements only."""
+    imports: List[str] = []
+    for node in iter_statements(tree):
+        node_type = type(node)
+        if node_type is ast.Import:
+            imports.extend(alias.name for alias in node.names)
+        elif node_type is ast.ImportFrom and node.module:
+            imports.append(node.module)
+    return imports
+
+
+def _extract_imports(filepath: Path) -> List[str]:
+    """Extract all import statements from a Python file."""
+    imports = []
+    
+    try:
+        with open(filepath, 'rb') as f:
+            code = f.read()
+        
+        # Every import statement contains the keyword; skip parsing files without it
+        if b'import' not in code:
+            return imports
+        
+        # ast.parse decodes bytes itself (honouring BOMs and coding cookies)
+        tree = ast.parse(code, filename=str(filepath))
+        
+        imports = _collect_imports(tree)
+        
+    except SyntaxError as e:
+        logger.warning(f"Syntax error in {filepath}: {e}")
+    except Exception as e:
+        logger.error(f"Error parsing {filepath}: {e}")
+        
+    return imports
+
+
+def _extract_imports_worker(path_str: str) -> List[str]:
+    """Picklable entry point for worker processes."""
+    return _extract_imports(Path(path_str))
+
 
 class DependencyGraphBuilder:
     """Build and analyze dependency graphs from Python codebases."""
@@ -22,6 +86,7 @@ class DependencyGraphBuilder:
         self.reverse_graph = defaultdict(set)  # file -> set of files that import it
         self.circular_deps = []
         self.missing_imports = []
+        self.modules_by_leaf: Dict[str, List[str]] = defaultdict(list)  # last name part -> module names
         
     def build_graph(self, upload_id: str) -> Dict:
         """
@@ -33,13 +98,19 @@ class DependencyGraphBuilder:
         logger.info(f"Building dependency graph for upload_id: {upload_id}")
         
         # Find all Python files
-        python_files = list(self.upload_dir.glob("**/*.py"))
+        python_files, rel_paths = self._find_python_files()
         logger.info(f"Found {len(python_files)} Python files")
         
-        # Extract imports from each file
-        for py_file in python_files:
-            rel_path = str(py_file.relative_to(self.upload_dir))
-            imports = self._extract_imports(py_file)
+        # An identical set of files (in this or any other upload) gives an identical graph
+        graph_key = self._graph_key(python_files, rel_paths)
+        cached = self._load_cached_graph(graph_key) if graph_key else None
+        if cached is not None:
+            self._restore_from_graph_data(cached)
+            logger.info(f"Reusing cached graph {graph_key[:12]} for upload_id: {upload_id}")
+            return cached
+        
+        # Extract imports from each file (parsing is CPU bound, so use processes for big uploads)
+        for rel_path, imports in zip(rel_paths, self._extract_all_imports(python_files)):
             self.files_data[rel_path] = imports
             
         # Build graph relationships
@@ -53,33 +124,97 @@ class DependencyGraphBuilder:
         
         logger.info(f"Graph built: {len(graph_data['nodes'])} nodes, {len(graph_data['edges'])} edges")
         
+        if graph_key:
+            self._store_cached_graph(graph_key, graph_data)
+        
         return graph_data
     
-    def _extract_imports(self, filepath: Path) -> List[str]:
-        """Extract all import statements from a Python file."""
-        imports = []
+    def _find_python_files(self) -> Tuple[List[Path], List[str]]:
+        """
+        Walk the upload for .py files, pruning excluded directories (virtualenvs,
+        node_modules, ...) rather than descending into them.
+        Returns parallel lists of absolute paths and upload-relative paths.
+        """
+        python_files: List[Path] = []
+        rel_paths: List[str] = []
+        base = str(self.upload_dir)
+        
+        for root, dirs, files in os.walk(base):
+            dirs[:] = [d for d in dirs if not is_excluded_dir(d)]
+            rel_root = os.path.relpath(root, base)
+            for name in files:
+                if name.endswith('.py'):
+                    python_files.append(Path(root, name))
+                    rel_paths.append(name if rel_root == '.' else os.path.join(rel_root, name))
+        
+        return python_files, rel_paths
+    
+    def _graph_key(self, python_files: List[Path], rel_paths: List[str]) -> Optional[str]:
+        """
+        Content key for a set of files: a hash over sorted (relative path, file hash) pairs.
+        Hashes recorded at extraction are used where available. Returns None if any
+        file can't be hashed.
+        """
+        upload_meta = read_upload_meta(self.upload_dir)
+        known_hashes = upload_meta.get('content_hashes', {}) if upload_meta else {}
+        
+        entries = []
+        for py_file, rel_path in zip(python_files, rel_paths):
+            file_hash = known_hashes.get(rel_path.replace('\\', '/')) or compute_file_hash(py_file)
+            if not file_hash:
+                return None
+            entries.append(f"{rel_path}:{file_hash}")
+        file_hash_cache.flush()
         
+        entries.sort()
+        digest = hashlib.sha256(f"v{GRAPH_CACHE_VERSION}\n".encode())
+        digest.update('\n'.join(entries).encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest()
+    
+    def _load_cached_graph(self, graph_key: str) -> Optional[Dict]:
+        """Return a previously built graph for this content key, if any."""
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                code = f.read()
-                
-            tree = ast.parse(code, filename=str(filepath))
-            
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Import):
-                    for alias in node.names:
-                        imports.append(alias.name)
-                        
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module:
-                        imports.append(node.module)
-                        
-        except SyntaxError as e:
-            logger.warning(f"Syntax error in {filepath}: {e}")
+            cache_file = GRAPH_CACHE_DIR / f"{graph_key}.json"
+            graph_data = orjson.loads(cache_file.read_bytes())
+            touch_cache_entry(cache_file)
+            return graph_data
+        except FileNotFoundError:
+            return None
         except Exception as e:
-            logger.error(f"Error parsing {filepath}: {e}")
-            
-        return imports
+            logger.debug(f"Ignoring unreadable graph cache entry {graph_key}: {e}")
+            return None
+    
+    def _store_cached_graph(self, graph_key: str, graph_data: Dict):
+        """Cache a built graph by content key (atomic, safe across worker processes)."""
+        cache_file = GRAPH_CACHE_DIR / f"{graph_key}.json"
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            GRAPH_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_file.write_bytes(orjson.dumps(graph_data))
+            os.replace(tmp_file, cache_file)
+            prune_cache_dir(GRAPH_CACHE_DIR, max_entries=GRAPH_CACHE_MAX_ENTRIES)
+        except Exception as e:
+            logger.debug(f"Error saving graph cache entry {graph_key}: {e}")
+    
+    def _restore_from_graph_data(self, graph_data: Dict):
+        """Rebuild the builder's state from cached graph data so file queries still work."""
+        for node in graph_data['nodes']:
+            self.files_data[node['id']] = []
+        for edge in graph_data['edges']:
+            self.graph[edge['from']].add(edge['to'])
+            self.reverse_graph[edge['to']].add(edge['from'])
+        self.circular_deps = graph_data['circular_dependencies']
+        self.missing_imports = graph_data['missing_imports']
+    
+    def _extract_all_imports(self, python_files: List[Path]) -> List[List[str]]:
+        """Extract imports for every file, in order, across the shared worker pool when worthwhile."""
+        max_workers = min(len(python_files), pool_size())
+        if max_workers <= 1 or len(python_files) < PARALLEL_MIN_FILES:
+            return [_extract_imports(py_file) for py_file in python_files]
+        
+        # A few chunks per worker amortizes IPC while keeping the load balanced
+        chunksize = max(1, len(python_files) // (max_workers * 8))
+        return process_map(_extract_imports_worker, map(str, python_files), chunksize=chunksize)
     
     def _build_relationships(self):
         """Build graph relationships between files based on imports."""
@@ -104,39 +239,62 @@ class DependencyGraphBuilder:
                     })
     
     def _build_module_mapping(self) -> Dict[str, str]:
-        """Create mapping from module names to file paths."""
+        """
+        Create mapping from full module names to file paths.
+        Only the canonical name is stored; imports written relative to a
+        package root below the upload root are matched by suffix in
+        _resolve_import via the modules_by_leaf index.
+        """
         module_map = {}
         
         for file_path in self.files_data.keys():
             # Convert file path to module name
             # e.g., "app/services/parser.py" -> "app.services.parser"
-            module_name = file_path.replace('/', '.').replace('\\', '.').replace('.py', '')
+            module_name = file_path.replace('\\', '/').removesuffix('.py').replace('/', '.')
+            # A package's __init__ is imported by the package name
+            module_name = module_name.removesuffix('.__init__')
             module_map[module_name] = file_path
-            
-            # Also map shorter versions
-            parts = module_name.split('.')
-            for i in range(len(parts)):
-                partial = '.'.join(parts[i:])
-                if partial not in module_map:
-                    module_map[partial] = file_path
+            self.modules_by_leaf[module_name.rpartition('.')[2]].append(module_name)
         
         return module_map
     
     def _resolve_import(self, import_name: str, source_file: str, module_map: Dict[str, str]) -> Optional[str]:
         """Resolve an import name to a file path in the codebase."""
-        # Direct match
-        if import_name in module_map:
-            return module_map[import_name]
+        source_parts = source_file.replace('\\', '/').split('/')
         
-        # Check if it's a submodule of something in our codebase
+        # Longest importable prefix wins: "pkg.mod.func" falls back to "pkg.mod", then "pkg"
         parts = import_name.split('.')
         for i in range(len(parts), 0, -1):
             partial = '.'.join(parts[:i])
             if partial in module_map:
                 return module_map[partial]
+            
+            # The upload may wrap the package root in extra folders ("proj/app/x.py"
+            # imported as "app.x"); match on a dotted suffix instead
+            suffix = '.' + partial
+            candidates = [
+                module for module in self.modules_by_leaf.get(parts[i - 1], ())
+                if module.endswith(suffix)
+            ]
+            if candidates:
+                # Prefer the candidate nearest the importing file, then the shortest name
+                best = min(candidates, key=lambda module: (
+                    -self._shared_prefix_len(module.split('.'), source_parts), len(module), module
+                ))
+                return module_map[best]
         
         return None
     
+    @staticmethod
+    def _shared_prefix_len(a: List[str], b: List[str]) -> int:
+        """Number of leading path parts two module paths have in common."""
+        count = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            count += 1
+        return count
+    
     def _is_local_import(self, import_name: str) -> bool:
         """Check if import appears to be from local codebase (not external package)."""
         # Simple heuristic: if it starts with common local patterns
@@ -145,50 +303,136 @@ class DependencyGraphBuilder:
         return first_part in local_patterns
     
     def _detect_circular_dependencies(self):
-        """Detect circular dependencies using DFS."""
-        visited = set()
-        rec_stack = set()
-        
-        def dfs(node: str, path: List[str]) -> bool:
-            """DFS to detect cycles."""
-            visited.add(node)
-            rec_stack.add(node)
-            path.append(node)
+        """
+        Detect circular dependencies.
+        Every strongly connected component with more than one file (or a file
+        importing itself) contains a cycle; one shortest cycle is reported per
+        component, as a chain that starts and ends with the same file.
+        """
+        for scc in self._strongly_connected_components():
+            start = min(scc)
+            if len(scc) > 1 or start in self.graph.get(start, ()):
+                self.circular_deps.append(self._shortest_cycle(start, set(scc)))
+    
+    def _to_csr(self) -> Tuple[List[str], array, array]:
+        """
+        Snapshot the graph in compressed-sparse-row form: sorted node names,
+        plus flat int arrays where node i's targets are indices[indptr[i]:indptr[i + 1]].
+        """
+        nodes = sorted(set(self.graph).union(*self.graph.values()))
+        node_idx = {node: i for i, node in enumerate(nodes)}
+        
+        indptr = array('i', [0])
+        indices = array('i')
+        for node in nodes:
+            # Nodes are sorted, so sorting indices keeps neighbors in name order
+            indices.extend(sorted(node_idx[target] for target in self.graph.get(node, ())))
+            indptr.append(len(indices))
+        
+        return nodes, indptr, indices
+    
+    def _strongly_connected_components(self) -> List[List[str]]:
+        """
+        Tarjan's SCC algorithm over the CSR snapshot, iterative so deep import
+        chains can't hit the recursion limit.
+        """
+        nodes, indptr, indices = self._to_csr()
+        count = len(nodes)
+        
+        index = [-1] * count
+        lowlink = [0] * count
+        on_stack = bytearray(count)
+        stack: List[int] = []
+        sccs: List[List[str]] = []
+        counter = 0
+        
+        for root in range(count):
+            if index[root] != -1:
+                continue
             
-            for neighbor in self.graph.get(node, []):
-                if neighbor not in visited:
-                    if dfs(neighbor, path.copy()):
-                        return True
-                elif neighbor in rec_stack:
-                    # Found cycle
-                    cycle_start = path.index(neighbor)
-                    cycle = path[cycle_start:] + [neighbor]
-                    self.circular_deps.append(cycle)
-                    return True
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, indptr[root])]  # (node, position of next edge to visit)
             
-            rec_stack.remove(node)
-            return False
+            while work:
+                node, pos = work[-1]
+                end = indptr[node + 1]
+                
+                while pos < end:
+                    neighbor = indices[pos]
+                    pos += 1
+                    if index[neighbor] == -1:
+                        # Descend into the neighbor; resume this node at pos afterwards
+                        work[-1] = (node, pos)
+                        index[neighbor] = lowlink[neighbor] = counter
+                        counter += 1
+                        stack.append(neighbor)
+                        on_stack[neighbor] = 1
+                        work.append((neighbor, indptr[neighbor]))
+                        break
+                    elif on_stack[neighbor] and index[neighbor] < lowlink[node]:
+                        lowlink[node] = index[neighbor]
+                else:
+                    # All neighbors done
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        if lowlink[node] < lowlink[parent]:
+                            lowlink[parent] = lowlink[node]
+                    
+                    if lowlink[node] == index[node]:
+                        scc = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = 0
+                            scc.append(nodes[member])
+                            if member == node:
+                                break
+                        sccs.append(scc)
         
-        for node in self.graph.keys():
-            if node not in visited:
-                dfs(node, [])
+        return sccs
+    
+    def _shortest_cycle(self, start: str, members: Set[str]) -> List[str]:
+        """BFS within a strongly connected component for the shortest cycle through start."""
+        parents: Dict[str, Optional[str]] = {start: None}
+        queue = deque([start])
+        
+        while queue:
+            node = queue.popleft()
+            for neighbor in sorted(self.graph.get(node, ())):
+                if neighbor == start:
+                    cycle = [node]
+                    while parents[cycle[-1]] is not None:
+                        cycle.append(parents[cycle[-1]])
+                    cycle.reverse()
+                    return cycle + [start]
+                if neighbor in members and neighbor not in parents:
+                    parents[neighbor] = node
+                    queue.append(neighbor)
+        
+        return [start, start]
     
     def _generate_graph_data(self) -> Dict:
         """Generate graph data structure for visualization."""
         nodes = []
         edges = []
         
-        # Get all unique files (nodes)
-        all_files = set(self.files_data.keys())
+        # Get all unique files (nodes); files_data keys are already unique
+        all_files = self.files_data.keys()
         
         for file_path in all_files:
             # Calculate node metrics
-            imports_count = len(self.graph.get(file_path, set()))
-            imported_by_count = len(self.reverse_graph.get(file_path, set()))
+            imports_count = len(self.graph.get(file_path, ()))
+            imported_by_count = len(self.reverse_graph.get(file_path, ()))
+            
+            # Basename by string slicing; no PurePath per node
+            label = file_path[max(file_path.rfind('/'), file_path.rfind('\\')) + 1:]
             
             nodes.append({
                 'id': file_path,
-                'label': Path(file_path).name,
+                'label': label,
                 'full_path': file_path,
                 'imports_count': imports_count,
                 'imported_by_count': imported_by_count,
@@ -228,21 +472,13 @@ class DependencyGraphBuilder:
     
     def _get_most_imported(self, limit: int) -> List[Dict]:
         """Get files that are imported the most."""
-        file_counts = [
-            {'file': file, 'count': len(importers)}
-            for file, importers in self.reverse_graph.items()
-        ]
-        file_counts.sort(key=lambda x: x['count'], reverse=True)
-        return file_counts[:limit]
+        top = heapq.nlargest(limit, self.reverse_graph.items(), key=lambda item: len(item[1]))
+        return [{'file': file, 'count': len(importers)} for file, importers in top]
     
     def _get_most_imports(self, limit: int) -> List[Dict]:
         """Get files that import the most."""
-        file_counts = [
-            {'file': file, 'count': len(imports)}
-            for file, imports in self.graph.items()
-        ]
-        file_counts.sort(key=lambda x: x['count'], reverse=True)
-        return file_counts[:limit]
+        top = heapq.nlargest(limit, self.graph.items(), key=lambda item: len(item[1]))
+        return [{'file': file, 'count': len(imports)} for file, imports in top]
     
     def get_file_dependencies(self, file_path: str) -> Dict:
         """Get direct dependencies for a specific file."""
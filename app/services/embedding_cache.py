@@ -2,12 +2,14 @@
 Embedding cache optimization for multi-codebase scenarios.
 Reduces redundant computation by sharing common chunks across uploads.
 """
+import atexit
 import hashlib
 import json
-from typing import Dict, List, Optional, Set
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from pathlib import Path
-from datetime import datetime
-from collections import defaultdict
 
 from utils.logger import setup_logger
 
@@ -20,62 +22,157 @@ class EmbeddingCacheManager:
     Uses content-based hashing to identify identical code chunks.
     """
     
+    INDEX_DB_FILENAME = "index.db"
+    LEGACY_INDEX_FILENAME = "embedding_index.json"
+    
+    # Buffered store_embedding calls are written in one transaction once this
+    # many are pending, or FLUSH_INTERVAL seconds after the first of them was
+    # buffered (and on flush() / interpreter exit). The interval bounds what a
+    # killed or restarted worker can lose.
+    FLUSH_EVERY = 1000
+    FLUSH_INTERVAL = 2.0
+    
+    # Bump when the table layout changes; older index files are rebuilt
+    SCHEMA_VERSION = 1
+    
+    # Embedding IDs are interned once into `embeddings`; the other tables
+    # refer to them by integer key, so per-upload membership rows and the
+    # shared-embedding join compare small ints rather than hex strings.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS embeddings (
+            id INTEGER PRIMARY KEY,
+            embedding_id TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS hash_to_embedding (
+            hash TEXT PRIMARY KEY,
+            embedding INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_hash_to_embedding_embedding
+            ON hash_to_embedding (embedding);
+        CREATE TABLE IF NOT EXISTS upload_embeddings (
+            upload_id TEXT NOT NULL,
+            embedding INTEGER NOT NULL,
+            PRIMARY KEY (upload_id, embedding)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_upload_embeddings_embedding
+            ON upload_embeddings (embedding);
+    """
+    
     def __init__(self, cache_dir: Path = Path("embeddings_cache")):
         self.cache_dir = cache_dir
         self.cache_dir.mkdir(exist_ok=True)
         
-        # In-memory index: hash -> embedding_id
-        self.hash_to_embedding: Dict[str, str] = {}
-        
-        # Track which uploads use which embeddings
-        self.upload_embeddings: Dict[str, Set[str]] = defaultdict(set)
-        
         # Statistics
         self.cache_hits = 0
         self.cache_misses = 0
         
-        self._load_index()
+        # One connection shared across request threads, serialised by a lock
+        # (re-entrant, so flush() can hold it across its transaction).
+        # Autocommit mode: every statement is its own (cheap, WAL) transaction.
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            self.cache_dir / self.INDEX_DB_FILENAME,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._init_db()
+        
+        # Writes not yet flushed: (content_hash, embedding_id, upload_id) rows,
+        # plus a hash -> embedding_id view so lookups still see them
+        self._pending: List[Tuple[str, str, str]] = []
+        self._pending_hashes: Dict[str, str] = {}
+        self._flush_timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
     
-    def _load_index(self):
-        """Load existing embedding index from disk."""
-        index_file = self.cache_dir / "embedding_index.json"
+    def _init_db(self):
+        """Create the index tables and import a legacy JSON index if present."""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                self._conn.executescript("""
+                    DROP TABLE IF EXISTS hash_to_embedding;
+                    DROP TABLE IF EXISTS upload_embeddings;
+                    DROP TABLE IF EXISTS embeddings;
+                """)
+            
+            self._conn.executescript(self.SCHEMA)
+            self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
         
-        if index_file.exists():
-            try:
-                with open(index_file, 'r') as f:
-                    data = json.load(f)
-                    self.hash_to_embedding = data.get('hash_to_embedding', {})
-                    
-                    # Convert upload embeddings back to sets
-                    upload_emb = data.get('upload_embeddings', {})
-                    self.upload_embeddings = {
-                        k: set(v) for k, v in upload_emb.items()
-                    }
-                    
-                logger.info(f"Loaded embedding index: {len(self.hash_to_embedding)} cached embeddings")
-            except Exception as e:
-                logger.warning(f"Failed to load embedding index: {e}")
-    
-    def _save_index(self):
-        """Save embedding index to disk."""
-        index_file = self.cache_dir / "embedding_index.json"
+        self._migrate_legacy_index()
+        
+        count = self._conn.execute("SELECT COUNT(*) FROM hash_to_embedding").fetchone()[0]
+        logger.info(f"Loaded embedding index: {count} cached embeddings")
+    
+    def _migrate_legacy_index(self):
+        """One-off import of the old embedding_index.json into SQLite."""
+        index_file = self.cache_dir / self.LEGACY_INDEX_FILENAME
+        
+        if not index_file.exists():
+            return
         
         try:
-            data = {
-                'hash_to_embedding': self.hash_to_embedding,
-                'upload_embeddings': {
-                    k: list(v) for k, v in self.upload_embeddings.items()
-                },
-                'updated_at': datetime.utcnow().isoformat()
-            }
+            with open(index_file, 'r') as f:
+                data = json.load(f)
+            
+            upload_rows = [
+                (upload_id, embedding_id)
+                for upload_id, embedding_ids in data.get('upload_embeddings', {}).items()
+                for embedding_id in embedding_ids
+            ]
             
-            with open(index_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            with self._transaction():
+                for content_hash, embedding_id in data.get('hash_to_embedding', {}).items():
+                    self._insert_hash(content_hash, self._intern(embedding_id))
+                for upload_id, embedding_id in upload_rows:
+                    self._insert_membership(upload_id, self._intern(embedding_id))
+            
+            index_file.rename(index_file.with_suffix('.json.migrated'))
+            logger.info(f"Migrated legacy embedding index from {index_file}")
         except Exception as e:
-            logger.error(f"Failed to save embedding index: {e}")
+            logger.warning(f"Failed to migrate legacy embedding index: {e}")
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the lock and run the enclosed statements as one transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+    
+    def _intern(self, embedding_id: str) -> int:
+        """Return the integer key for an embedding ID, assigning one if new."""
+        self._conn.execute(
+            "INSERT OR IGNORE INTO embeddings (embedding_id) VALUES (?)",
+            (embedding_id,)
+        )
+        return self._conn.execute(
+            "SELECT id FROM embeddings WHERE embedding_id = ?",
+            (embedding_id,)
+        ).fetchone()[0]
+    
+    def _insert_hash(self, content_hash: str, embedding: int):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO hash_to_embedding VALUES (?, ?)",
+            (content_hash, embedding)
+        )
+    
+    def _insert_membership(self, upload_id: str, embedding: int):
+        self._conn.execute(
+            "INSERT OR IGNORE INTO upload_embeddings VALUES (?, ?)",
+            (upload_id, embedding)
+        )
     
     def compute_content_hash(self, content: str) -> str:
         """Compute SHA256 hash of content."""
+        # Kept on SHA-256 deliberately: OpenSSL uses the CPU's SHA extensions,
+        # which beat BLAKE2b here at every chunk size, and existing keys stay valid
         return hashlib.sha256(content.encode('utf-8')).hexdigest()
     
     def get_cached_embedding(self, content: str) -> Optional[str]:
@@ -90,9 +187,18 @@ class EmbeddingCacheManager:
         """
         content_hash = self.compute_content_hash(content)
         
-        if content_hash in self.hash_to_embedding:
+        with self._lock:
+            pending_id = self._pending_hashes.get(content_hash)
+            row = (pending_id,) if pending_id is not None else self._conn.execute(
+                "SELECT e.embedding_id FROM hash_to_embedding h "
+                "JOIN embeddings e ON e.id = h.embedding "
+                "WHERE h.hash = ?",
+                (content_hash,)
+            ).fetchone()
+        
+        if row is not None:
             self.cache_hits += 1
-            embedding_id = self.hash_to_embedding[content_hash]
+            embedding_id = row[0]
             logger.debug(f"Cache HIT for hash {content_hash[:8]}... -> {embedding_id}")
             return embedding_id
         else:
@@ -116,20 +222,59 @@ class EmbeddingCacheManager:
         """
         content_hash = self.compute_content_hash(content)
         
-        # Store hash -> embedding mapping
-        self.hash_to_embedding[content_hash] = embedding_id
-        
-        # Track which upload uses this embedding
-        self.upload_embeddings[upload_id].add(embedding_id)
+        with self._lock:
+            self._pending.append((content_hash, embedding_id, upload_id))
+            self._pending_hashes[content_hash] = embedding_id
+            should_flush = len(self._pending) >= self.FLUSH_EVERY
+            if not should_flush and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.FLUSH_INTERVAL, self._timed_flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
         
-        # Save index
-        self._save_index()
+        if should_flush:
+            self.flush()
         
         logger.debug(f"Stored embedding {embedding_id} for hash {content_hash[:8]}...")
     
+    def flush(self):
+        """Write buffered store_embedding calls to the index in one transaction."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending:
+                return
+            
+            with self._transaction():
+                for content_hash, embedding_id, upload_id in self._pending:
+                    embedding = self._intern(embedding_id)
+                    # Store hash -> embedding mapping
+                    self._insert_hash(content_hash, embedding)
+                    # Track which upload uses this embedding
+                    self._insert_membership(upload_id, embedding)
+            
+            # Only dropped once committed, so a failed write is retried next flush
+            self._pending = []
+            self._pending_hashes.clear()
+    
+    def _timed_flush(self):
+        """FLUSH_INTERVAL timer callback; runs on its own thread, so errors are logged here."""
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning(f"Failed to flush buffered embeddings: {e}")
+    
     def get_upload_embeddings(self, upload_id: str) -> Set[str]:
         """Get all embedding IDs used by an upload."""
-        return self.upload_embeddings.get(upload_id, set())
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT e.embedding_id FROM upload_embeddings u "
+                "JOIN embeddings e ON e.id = u.embedding "
+                "WHERE u.upload_id = ?",
+                (upload_id,)
+            ).fetchall()
+        return {row[0] for row in rows}
     
     def find_shared_embeddings(
         self,
@@ -140,10 +285,17 @@ class EmbeddingCacheManager:
         Find embeddings shared between two uploads.
         Indicates identical code chunks.
         """
-        emb1 = self.upload_embeddings.get(upload_id1, set())
-        emb2 = self.upload_embeddings.get(upload_id2, set())
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT e.embedding_id FROM upload_embeddings a "
+                "JOIN upload_embeddings b ON b.embedding = a.embedding "
+                "JOIN embeddings e ON e.id = a.embedding "
+                "WHERE a.upload_id = ? AND b.upload_id = ?",
+                (upload_id1, upload_id2)
+            ).fetchall()
         
-        shared = emb1 & emb2
+        shared = {row[0] for row in rows}
         logger.info(f"Shared embeddings between {upload_id1} and {upload_id2}: {len(shared)}")
         
         return shared
@@ -153,9 +305,18 @@ class EmbeddingCacheManager:
         total_requests = self.cache_hits + self.cache_misses
         hit_rate = (self.cache_hits / total_requests * 100) if total_requests > 0 else 0
         
+        self.flush()
+        with self._lock:
+            total_cached = self._conn.execute(
+                "SELECT COUNT(*) FROM hash_to_embedding"
+            ).fetchone()[0]
+            total_uploads = self._conn.execute(
+                "SELECT COUNT(DISTINCT upload_id) FROM upload_embeddings"
+            ).fetchone()[0]
+        
         return {
-            'total_cached_embeddings': len(self.hash_to_embedding),
-            'total_uploads_tracked': len(self.upload_embeddings),
+            'total_cached_embeddings': total_cached,
+            'total_uploads_tracked': total_uploads,
             'cache_hits': self.cache_hits,
             'cache_misses': self.cache_misses,
             'hit_rate_percent': round(hit_rate, 2),
@@ -166,7 +327,9 @@ class EmbeddingCacheManager:
         """Estimate total cache size in bytes."""
         total_size = 0
         
-        for embedding_file in self.cache_dir.glob("*.json"):
+        index_files = self.cache_dir.glob(f"{self.INDEX_DB_FILENAME}*")
+        
+        for embedding_file in [*self.cache_dir.glob("*.json"), *index_files]:
             try:
                 total_size += embedding_file.stat().st_size
             except:
@@ -179,27 +342,36 @@ class EmbeddingCacheManager:
         Remove embeddings for a deleted upload.
         Only removes if no other uploads share them.
         """
-        if upload_id not in self.upload_embeddings:
-            return
-        
-        embeddings = self.upload_embeddings[upload_id]
-        
-        # Check if other uploads use these embeddings
-        for embedding_id in embeddings:
-            # Count how many uploads use this embedding
-            usage_count = sum(
-                1 for emb_set in self.upload_embeddings.values()
-                if embedding_id in emb_set
-            )
+        self.flush()
+        with self._transaction():
+            embeddings = self._conn.execute(
+                "SELECT u.embedding, e.embedding_id FROM upload_embeddings u "
+                "JOIN embeddings e ON e.id = u.embedding "
+                "WHERE u.upload_id = ?",
+                (upload_id,)
+            ).fetchall()
             
-            # If only this upload uses it, we could delete the embedding file
-            # But for safety, we'll keep it (orphaned embeddings cleaned up separately)
-            if usage_count == 1:
-                logger.debug(f"Embedding {embedding_id} now orphaned (was only used by {upload_id})")
-        
-        # Remove from tracking
-        del self.upload_embeddings[upload_id]
-        self._save_index()
+            if not embeddings:
+                return
+            
+            # Check if other uploads use these embeddings
+            for embedding, embedding_id in embeddings:
+                # Count how many uploads use this embedding (indexed lookup)
+                usage_count = self._conn.execute(
+                    "SELECT COUNT(*) FROM upload_embeddings WHERE embedding = ?",
+                    (embedding,)
+                ).fetchone()[0]
+                
+                # If only this upload uses it, we could delete the embedding file
+                # But for safety, we'll keep it (orphaned embeddings cleaned up separately)
+                if usage_count == 1:
+                    logger.debug(f"Embedding {embedding_id} now orphaned (was only used by {upload_id})")
+            
+            # Remove from tracking
+            self._conn.execute(
+                "DELETE FROM upload_embeddings WHERE upload_id = ?",
+                (upload_id,)
+            )
         
         logger.info(f"Cleaned up embedding tracking for {upload_id}")
     
@@ -217,15 +389,20 @@ class EmbeddingCacheManager:
         shared_embeddings = self.find_shared_embeddings(upload_id1, upload_id2)
         
         duplicates = []
-        for embedding_id in shared_embeddings:
-            # Find content hash for this embedding
-            content_hash = None
-            for hash_val, emb_id in self.hash_to_embedding.items():
-                if emb_id == embedding_id:
-                    content_hash = hash_val
-                    break
-            
-            if content_hash:
+        with self._lock:
+            for embedding_id in shared_embeddings:
+                # Find content hash for this embedding (embedding_id -> hash index)
+                row = self._conn.execute(
+                    "SELECT h.hash FROM hash_to_embedding h "
+                    "JOIN embeddings e ON e.id = h.embedding "
+                    "WHERE e.embedding_id = ? LIMIT 1",
+                    (embedding_id,)
+                ).fetchone()
+                
+                if row is None:
+                    continue
+                
+                content_hash = row[0]
                 duplicates.append({
                     'content_hash': content_hash,
                     'embedding_id': embedding_id,
@@ -2,39 +2,264 @@
 Metadata Builder - Constructs standardized codebase metadata.
 Analyzes uploaded codebase and extracts all relevant information.
 """
+import os
 import ast
-from typing import List, Dict, Optional, Set
+import hashlib
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Dict, Optional, Set, Tuple
 from pathlib import Path
 from datetime import datetime
-from collections import defaultdict
+from collections import Counter
+
+import orjson
 
 from app.models.codebase_metadata import (
     CodebaseMetadata,
     FileMetadataStandard,
     DependencyMetadata
 )
-from app.services.comparison import compute_file_hash
+from app.services.ast_walk import iter_statements
+from app.services.comparison import compute_file_hash, file_hash_cache
+from app.services.process_pool import pool_size, process_map
+from app.services.upload_meta import EXCLUDE_DIRS, is_excluded_dir, read_upload_meta
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# (filepath, top-level folder, stat) for each file to scan
+_Candidate = Tuple[Path, str, os.stat_result]
+
+# Below this many Python files a process pool costs more to start than it saves
+PARALLEL_MIN_FILES = 32
+
+
+def _extract_python_metrics(filepath: Path, with_hash: bool = False) -> Dict:
+    """
+    Extract metrics from Python file using AST, so class/def/import lines inside
+    strings and docstrings are never counted. Only statements are visited
+    (see iter_statements), never expression nodes. Files with syntax errors report
+    only their line count. With `with_hash`, also returns the content SHA256
+    under 'hash', computed from the same read so the file is opened once.
+    Results are cached by content hash (see _MetricsCache).
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        
+        lines = content.count(b'\n') + 1
+        classes = 0
+        functions = 0
+        imports = []
+        
+        try:
+            # Parsing bytes honours PEP 263 coding declarations
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            # File has syntax errors (or null bytes), return basic info
+            tree = None
+        
+        if tree is not None:
+            for node in iter_statements(tree):
+                node_type = type(node)
+                if node_type is ast.FunctionDef:
+                    functions += 1
+                elif node_type is ast.ClassDef:
+                    classes += 1
+                elif node_type is ast.Import:
+                    imports.extend(alias.name for alias in node.names)
+                elif node_type is ast.ImportFrom and node.module:
+                    imports.append(node.module)
+        
+        metrics = {
+            'lines': lines,
+            'classes': classes,
+            'functions': functions,
+            'imports': imports
+        }
+        if with_hash:
+            metrics['hash'] = hashlib.sha256(content).hexdigest()
+        return metrics
+    except Exception as e:
+        logger.warning(f"Failed to parse {filepath}: {e}")
+        return {
+            'lines': 0,
+            'classes': 0,
+            'functions': 0,
+            'imports': []
+        }
+
+
+# Metrics for files without an extractor; shared, so never mutate it
+NULL_METRICS = {'lines': None, 'classes': 0, 'functions': 0, 'imports': []}
+
+
+def _null_extractor(filepath: Path, with_hash: bool = False) -> Dict:
+    return NULL_METRICS
+
+
+# Extension -> metrics extractor. Supporting another language only means adding
+# an entry here; every extractor returns the same keys as _extract_python_metrics
+EXTRACTORS: Dict[str, Callable[[Path, bool], Dict]] = {
+    '.py': _extract_python_metrics,
+}
+
+
+def _extract_metrics_worker(path_str: str, ext: str, with_hash: bool) -> Dict:
+    """Picklable entry point for worker processes."""
+    return EXTRACTORS[ext](Path(path_str), with_hash)
+
+
+def _local_top_level_names(py_paths: Iterable[str]) -> Set[str]:
+    """
+    Names a local import can start with: top-level packages (directories with an
+    __init__.py whose parent has none) and the modules next to them or in the
+    upload root. Nested modules and plain folders don't count, so e.g. a local
+    app/logging.py never hides the stdlib logging import.
+    """
+    py_paths = list(py_paths)
+    package_dirs = {
+        os.path.dirname(path) for path in py_paths
+        if os.path.basename(path) == '__init__.py'
+    }
+    package_dirs.discard('')
+    top_packages = {d for d in package_dirs if os.path.dirname(d) not in package_dirs}
+    source_roots = {''} | {os.path.dirname(d) for d in top_packages}
+    
+    names = {os.path.basename(d) for d in top_packages}
+    names.update(
+        os.path.basename(path)[:-3] for path in py_paths
+        if os.path.dirname(path) in source_roots and os.path.basename(path) != '__init__.py'
+    )
+    return names
+
+
+class _MetricsCache:
+    """
+    Persistent (extension, content hash) -> metrics store, so files already seen
+    in any upload (or a previous scan) are never re-read and re-scanned.
+    Bounded to MAX_ROWS: once full, the least recently used rows are evicted.
+    """
+    
+    # Bump when an extractor or the table layout changes, so stale metrics are discarded
+    VERSION = 4
+    # Keep IN (...) lists under SQLite's bound-parameter limit
+    BATCH_SIZE = 500
+    MAX_ROWS = 200_000
+    # Hits refresh used_at at most this often, so repeat scans stay read-only
+    TOUCH_INTERVAL_SECONDS = 3600
+    
+    def __init__(self, db_file: Path):
+        self.db_file = db_file
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        # Caller holds the lock
+        if self._conn is None:
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                conn.execute("DROP TABLE IF EXISTS file_metrics")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_metrics ("
+                "ext TEXT, hash TEXT, lines INTEGER, classes INTEGER, "
+                "functions INTEGER, imports BLOB, used_at INTEGER, "
+                "PRIMARY KEY (ext, hash)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS file_metrics_used_at ON file_metrics (used_at)")
+            conn.execute(f"PRAGMA user_version = {self.VERSION}")
+            self._conn = conn
+        return self._conn
+    
+    def get_many(self, ext: str, hashes: Iterable[str]) -> Dict[str, Dict]:
+        """Return cached metrics for whichever of the given `ext` content hashes are known."""
+        hashes = list(set(hashes))
+        found = {}
+        now = int(time.time())
+        try:
+            with self._lock:
+                conn = self._connect()
+                stale = []
+                for start in range(0, len(hashes), self.BATCH_SIZE):
+                    batch = hashes[start:start + self.BATCH_SIZE]
+                    rows = conn.execute(
+                        "SELECT hash, lines, classes, functions, imports, used_at FROM file_metrics "
+                        f"WHERE ext = ? AND hash IN ({','.join('?' * len(batch))})",
+                        [ext, *batch]
+                    )
+                    for content_hash, lines, classes, functions, imports, used_at in rows:
+                        found[content_hash] = {
+                            'lines': lines,
+                            'classes': classes,
+                            'functions': functions,
+                            'imports': orjson.loads(imports)
+                        }
+                        if used_at < now - self.TOUCH_INTERVAL_SECONDS:
+                            stale.append(content_hash)
+                if stale:
+                    conn.execute("BEGIN")
+                    conn.executemany(
+                        "UPDATE file_metrics SET used_at = ? WHERE ext = ? AND hash = ?",
+                        [(now, ext, h) for h in stale]
+                    )
+                    conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning(f"File metrics cache unavailable: {e}")
+        return found
+    
+    def put_many(self, rows: List[Tuple[str, str, int, int, int, List[str]]]):
+        """Store (ext, content_hash, lines, classes, functions, imports) rows in one transaction."""
+        if not rows:
+            return
+        now = int(time.time())
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO file_metrics VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(ext, h, lines, classes, functions, orjson.dumps(imports), now)
+                     for ext, h, lines, classes, functions, imports in rows]
+                )
+                excess = conn.execute("SELECT COUNT(*) FROM file_metrics").fetchone()[0] - self.MAX_ROWS
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM file_metrics WHERE (ext, hash) IN ("
+                        "SELECT ext, hash FROM file_metrics ORDER BY used_at LIMIT ?)",
+                        (excess,)
+                    )
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to update file metrics cache: {e}")
+
+
+metrics_cache = _MetricsCache(Path("embeddings_cache") / "file_metrics.db")
+
 
 class MetadataBuilder:
     """Builds standardized metadata from uploaded codebase."""
     
     SUPPORTED_EXTENSIONS = {'.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.cpp', '.c', '.h'}
-    EXCLUDE_DIRS = {'__pycache__', '.git', 'venv', 'node_modules', '.venv', 'env', 'build', 'dist'}
+    EXCLUDE_DIRS = EXCLUDE_DIRS
+    MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
     
     def __init__(self, upload_dir: Path):
         self.upload_dir = upload_dir
         self.files_metadata: List[FileMetadataStandard] = []
-        self.file_types: Dict[str, int] = defaultdict(int)
-        self.folder_structure: Dict[str, int] = defaultdict(int)
+        self.file_types: Dict[str, int] = Counter()
+        self.folder_structure: Dict[str, int] = Counter()
         self.total_bytes = 0
         self.total_lines = 0
         self.total_classes = 0
         self.total_functions = 0
         self.external_packages: Set[str] = set()
+        self.content_hashes: Dict[str, str] = {}
     
     def build_metadata(self, upload_id: str) -> CodebaseMetadata:
         """
@@ -50,25 +275,42 @@ class MetadataBuilder:
         
         # Reset counters
         self.files_metadata = []
-        self.file_types = defaultdict(int)
-        self.folder_structure = defaultdict(int)
+        self.file_types = Counter()
+        self.folder_structure = Counter()
         self.total_bytes = 0
         self.total_lines = 0
         self.total_classes = 0
         self.total_functions = 0
         self.external_packages = set()
         
+        # Reuse content hashes recorded at upload time
+        upload_meta = read_upload_meta(self.upload_dir)
+        self.content_hashes = upload_meta.get('content_hashes', {}) if upload_meta else {}
+        
         # Scan all files
         self._scan_directory()
+        file_hash_cache.flush()
         
-        # Get upload info
+        # Get upload info; the sidecar already read above records the upload time,
+        # so only uploads without one need a stat
         upload_name = self.upload_dir.name
-        upload_time = datetime.fromtimestamp(self.upload_dir.stat().st_mtime)
+        if upload_meta and upload_meta.get('uploaded_at'):
+            upload_time = datetime.fromisoformat(upload_meta['uploaded_at'])
+        else:
+            upload_time = datetime.fromtimestamp(self.upload_dir.stat().st_mtime)
         
-        # Check if summaries exist
-        summary_dir = Path("summaries") / upload_id
-        has_summaries = summary_dir.exists() and any(summary_dir.glob('*.json'))
-        summaries_time = datetime.fromtimestamp(summary_dir.stat().st_mtime) if has_summaries else None
+        # Check if summaries exist: one stat and a scandir that stops at the first .json
+        has_summaries = False
+        summaries_time = None
+        summary_dir = os.path.join("summaries", upload_id)
+        try:
+            summary_mtime = os.stat(summary_dir).st_mtime
+            with os.scandir(summary_dir) as it:
+                has_summaries = any(entry.name.endswith('.json') for entry in it)
+            if has_summaries:
+                summaries_time = datetime.fromtimestamp(summary_mtime)
+        except OSError:
+            pass
         
         # Build dependency metadata if available
         dependencies = self._build_dependency_metadata()
@@ -95,119 +337,196 @@ class MetadataBuilder:
     
     def _scan_directory(self):
         """Scan directory and collect file metadata."""
-        for dirpath, dirnames, filenames in self.upload_dir.walk():
-            # Skip excluded directories
-            dirnames[:] = [d for d in dirnames if d not in self.EXCLUDE_DIRS]
+        candidates = []
+        self._collect_files(str(self.upload_dir), None, candidates)
+        
+        metric_indexes = [i for i, (filepath, _, _) in enumerate(candidates) if filepath.suffix.lower() in EXTRACTORS]
+        metric_set = set(metric_indexes)
+        other_indexes = [i for i in range(len(candidates)) if i not in metric_set]
+        results: List[Optional[FileMetadataStandard]] = [None] * len(candidates)
+        
+        # Per-file work is mostly file I/O, so overlap it across threads
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            # Files without an extractor only need I/O (hashing); start them first so
+            # they run while the metrics are being computed
+            other_results = executor.map(self._process_file, [candidates[i] for i in other_indexes])
             
-            # Get folder name for structure tracking
-            rel_dir = dirpath.relative_to(self.upload_dir)
-            folder_name = str(rel_dir.parts[0]) if rel_dir.parts else "root"
+            # Metrics: known content is served from the cache; the rest is
+            # CPU bound, so big uploads scan it across processes
+            metrics, cached_keys = self._extract_all_metrics(candidates)
             
-            for filename in filenames:
-                filepath = dirpath / filename
-                ext = filepath.suffix.lower()
-                
-                if ext not in self.SUPPORTED_EXTENSIONS:
-                    continue
+            metric_results = executor.map(
+                self._process_file,
+                [candidates[i] for i in metric_indexes],
+                [metrics[i] for i in metric_indexes]
+            )
+            
+            for i, file_meta in zip(other_indexes, other_results):
+                results[i] = file_meta
+            for i, file_meta in zip(metric_indexes, metric_results):
+                results[i] = file_meta
+        
+        folders: List[str] = []
+        for (filepath, folder_name, _), file_meta in zip(candidates, results):
+            if file_meta is None:
+                continue
+            
+            self.files_metadata.append(file_meta)
+            folders.append(folder_name)
+            
+            if file_meta.lines_count is not None:
+                # Update totals
+                self.total_lines += file_meta.lines_count
+                self.total_classes += file_meta.classes_count
+                self.total_functions += file_meta.functions_count
                 
+                # Track external packages by top-level name ("os.path" -> "os")
+                self.external_packages.update(
+                    imp.split('.', 1)[0] for imp in file_meta.imports
+                    if imp and not imp.startswith('.')
+                )
+            
+            self.total_bytes += file_meta.size_bytes
+        
+        # Update counters in one C-level counting pass each
+        self.file_types.update(file_meta.extension for file_meta in self.files_metadata)
+        self.folder_structure.update(folders)
+        
+        # Imports of the codebase's own top-level packages and modules aren't external
+        self.external_packages -= _local_top_level_names(
+            meta.relative_path for meta in self.files_metadata if meta.extension == '.py'
+        )
+        
+        # Remember freshly computed metrics; lines_count is 0 only when the read failed
+        metrics_cache.put_many([
+            (meta.extension, meta.content_hash, meta.lines_count, meta.classes_count,
+             meta.functions_count, meta.imports)
+            for meta in self.files_metadata
+            if meta.lines_count and meta.content_hash
+            and (meta.extension, meta.content_hash) not in cached_keys
+        ])
+    
+    def _collect_files(self, dirpath: str, folder_name: Optional[str], candidates: List[_Candidate]):
+        """
+        Recursively collect (filepath, top-level folder, stat) for supported files.
+        The stat comes from the DirEntry, so later stages never stat the file again.
+        """
+        try:
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"Failed to scan {dirpath}: {e}")
+            return
+        
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not is_excluded_dir(entry.name):
+                    subdirs.append(entry)
+            elif os.path.splitext(entry.name)[1].lower() in self.SUPPORTED_EXTENSIONS:
                 try:
-                    # Basic file info
-                    size_bytes = filepath.stat().st_size
-                    rel_path = filepath.relative_to(self.upload_dir)
-                    
-                    # Extract code metrics for Python files
-                    lines_count = None
-                    classes_count = 0
-                    functions_count = 0
-                    imports = []
-                    content_hash = ""
-                    
-                    if ext == '.py':
-                        metrics = self._extract_python_metrics(filepath)
-                        lines_count = metrics['lines']
-                        classes_count = metrics['classes']
-                        functions_count = metrics['functions']
-                        imports = metrics['imports']
-                        content_hash = compute_file_hash(filepath)
-                        
-                        # Update totals
-                        self.total_lines += lines_count
-                        self.total_classes += classes_count
-                        self.total_functions += functions_count
-                        
-                        # Track external packages
-                        for imp in imports:
-                            if not imp.startswith('.') and '.' not in imp:
-                                self.external_packages.add(imp)
-                    
-                    # Create file metadata
-                    file_meta = FileMetadataStandard(
-                        relative_path=str(rel_path).replace('\\', '/'),
-                        filename=filename,
-                        size_bytes=size_bytes,
-                        extension=ext,
-                        lines_count=lines_count,
-                        classes_count=classes_count,
-                        functions_count=functions_count,
-                        imports=imports,
-                        content_hash=content_hash
-                    )
-                    
-                    self.files_metadata.append(file_meta)
-                    
-                    # Update counters
-                    self.file_types[ext] += 1
-                    self.folder_structure[folder_name] += 1
-                    self.total_bytes += size_bytes
-                    
-                except Exception as e:
-                    logger.warning(f"Failed to process {filepath}: {e}")
+                    st = entry.stat()
+                except OSError as e:
+                    logger.warning(f"Failed to process {entry.path}: {e}")
+                    continue
+                candidates.append((Path(entry.path), folder_name or "root", st))
+        
+        for entry in subdirs:
+            self._collect_files(entry.path, folder_name or entry.name, candidates)
+    
+    def _extract_all_metrics(self, candidates: List[_Candidate]) -> Tuple[List[Optional[Dict]], Set[Tuple[str, str]]]:
+        """
+        Metrics for each candidate with an extractor, in order, looked up by the
+        content hash recorded at upload time or computed across worker processes
+        when worthwhile. Entries are None where _process_file should compute them inline.
+        Also returns the (extension, content hash) keys that were served from the cache.
+        """
+        metrics: List[Optional[Dict]] = [None] * len(candidates)
+        exts = [filepath.suffix.lower() for filepath, _, _ in candidates]
+        metric_indexes = [i for i, ext in enumerate(exts) if ext in EXTRACTORS]
+        
+        # Content hashes from extraction (or memoized by an earlier scan of the same,
+        # unmodified file) let unchanged files skip the read entirely
+        known_hashes: Dict[str, Dict[int, str]] = {}
+        for i in metric_indexes:
+            filepath, _, st = candidates[i]
+            rel_path = str(filepath.relative_to(self.upload_dir)).replace('\\', '/')
+            content_hash = self.content_hashes.get(rel_path) or file_hash_cache.get(str(filepath), st)
+            if content_hash:
+                known_hashes.setdefault(exts[i], {})[i] = content_hash
+        
+        cached_keys: Set[Tuple[str, str]] = set()
+        for ext, hashes in known_hashes.items():
+            cached = metrics_cache.get_many(ext, hashes.values())
+            for i, content_hash in hashes.items():
+                if content_hash in cached:
+                    metrics[i] = cached[content_hash]
+            cached_keys.update((ext, content_hash) for content_hash in cached)
+        metric_indexes = [i for i in metric_indexes if metrics[i] is None]
+        
+        max_workers = min(len(metric_indexes), pool_size())
+        if max_workers <= 1 or len(metric_indexes) < PARALLEL_MIN_FILES:
+            return metrics, cached_keys
+        
+        # A few chunks per worker amortizes IPC while keeping the load balanced
+        chunksize = max(1, len(metric_indexes) // (max_workers * 8))
+        paths = [str(candidates[i][0]) for i in metric_indexes]
+        with_hash = [i not in known_hashes.get(exts[i], ()) for i in metric_indexes]
+        # Shared forkserver pool: the scan thread pool is already running here,
+        # and forking a process while other threads hold locks can deadlock it
+        results = process_map(
+            _extract_metrics_worker, paths, [exts[i] for i in metric_indexes], with_hash,
+            chunksize=chunksize
+        )
+        for i, file_metrics in zip(metric_indexes, results):
+            metrics[i] = file_metrics
+        
+        return metrics, cached_keys
     
-    def _extract_python_metrics(self, filepath: Path) -> Dict:
-        """Extract metrics from Python file using AST."""
+    def _process_file(self, candidate: _Candidate, metrics: Optional[Dict] = None) -> Optional[FileMetadataStandard]:
+        """Build metadata for a single file. Returns None if the file can't be processed."""
+        filepath, _, st = candidate
+        ext = sys.intern(filepath.suffix.lower())
+        
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
+            # Basic file info
+            size_bytes = st.st_size
+            rel_path = str(filepath.relative_to(self.upload_dir)).replace('\\', '/')
             
-            lines = content.count('\n') + 1
+            content_hash = self.content_hashes.get(rel_path, "")
             
-            try:
-                tree = ast.parse(content)
-                classes = sum(1 for node in ast.walk(tree) if isinstance(node, ast.ClassDef))
-                functions = sum(1 for node in ast.walk(tree) if isinstance(node, ast.FunctionDef))
-                
-                # Extract imports
-                imports = []
-                for node in ast.walk(tree):
-                    if isinstance(node, ast.Import):
-                        for alias in node.names:
-                            imports.append(alias.name)
-                    elif isinstance(node, ast.ImportFrom):
-                        if node.module:
-                            imports.append(node.module)
-                
-                return {
-                    'lines': lines,
-                    'classes': classes,
-                    'functions': functions,
-                    'imports': imports
-                }
-            except SyntaxError:
-                # File has syntax errors, return basic info
-                return {
-                    'lines': lines,
-                    'classes': 0,
-                    'functions': 0,
-                    'imports': []
-                }
+            # Extract code metrics; files without an extractor get NULL_METRICS
+            if metrics is None:
+                metrics = EXTRACTORS.get(ext, _null_extractor)(filepath, not content_hash)
+            # Interned: the same few names (os, sys, typing, ...) repeat across every file
+            imports = [sys.intern(name) for name in metrics['imports']]
+            
+            # Hashed from the bytes the metrics scan already read
+            if not content_hash and metrics.get('hash'):
+                content_hash = metrics['hash']
+                file_hash_cache.put(str(filepath), st, content_hash)
+            
+            # Hash once at ingest (unless extraction already did) so comparisons
+            # are pure string checks and never have to reopen the file
+            if not content_hash:
+                content_hash = compute_file_hash(filepath)
+            
+            # Create file metadata
+            return FileMetadataStandard(
+                relative_path=rel_path,
+                filename=filepath.name,
+                size_bytes=size_bytes,
+                extension=ext,
+                lines_count=metrics['lines'],
+                classes_count=metrics['classes'],
+                functions_count=metrics['functions'],
+                imports=imports,
+                content_hash=content_hash
+            )
+        
         except Exception as e:
-            logger.warning(f"Failed to parse {filepath}: {e}")
-            return {
-                'lines': 0,
-                'classes': 0,
-                'functions': 0,
-                'imports': []
-            }
+            logger.warning(f"Failed to process {filepath}: {e}")
+            return None
     
     def _build_dependency_metadata(self) -> Optional[DependencyMetadata]:
         """Build dependency metadata if graph data is available."""
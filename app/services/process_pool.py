@@ -0,0 +1,78 @@
+"""
+Shared worker process pool for CPU-bound analysis (AST parsing, metrics scans).
+
+One pool serves every request instead of a new one per call. Workers are
+started with forkserver (spawn where unavailable) rather than fork: the server
+process runs event loop and threadpool threads, and forking while another
+thread holds a logging, I/O or import lock can deadlock the child.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, List, Optional
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def pool_size() -> int:
+    """Number of worker processes in the shared pool (1 means work runs inline)."""
+    return os.cpu_count() or 1
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Return the shared pool, creating it on first use (the app lifespan creates it
+    at startup). None on single-core hosts, where callers should run inline.
+    """
+    global _pool
+    if pool_size() <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=pool_size(), mp_context=_mp_context())
+        return _pool
+
+
+def process_map(fn: Callable, *iterables: Iterable, chunksize: int = 1) -> List:
+    """
+    Map a picklable function over the iterables in the shared pool and collect the results.
+    If a worker died, the broken pool is dropped so the next call starts a fresh one.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return list(map(fn, *iterables))
+    try:
+        return list(pool.map(fn, *iterables, chunksize=chunksize))
+    except BrokenProcessPool:
+        _discard(pool)
+        raise
+
+
+def _discard(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    logger.warning("Worker process pool broke; a new one will be started on next use")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_process_pool():
+    """Stop the shared pool's workers (app shutdown)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,129 @@
+"""
+Upload sidecar metadata.
+Small JSON summary written next to each extracted upload so listings
+don't need to walk the whole tree on every request.
+"""
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+META_FILENAME = '.meta.json'
+DIGEST_INDEX_FILENAME = '.upload_digests.json'
+# Serializes read-modify-write of the digest index within a process
+_digest_index_lock = threading.Lock()
+EXCLUDE_DIRS = frozenset({'__pycache__', '.git', 'venv', 'node_modules', '.venv', 'env', 'build', 'dist'})
+
+
+def is_excluded_dir(name: str) -> bool:
+    """
+    Whether a walker should skip a directory, checked before recursing into it.
+    Hidden directories (.git, .tox, .mypy_cache, ...) never hold code worth
+    analysing, so they are pruned by their leading dot without listing each one.
+    """
+    return name in EXCLUDE_DIRS or name.startswith('.')
+
+
+def count_files(upload_path: Path) -> int:
+    """Count files in an upload, skipping excluded directories."""
+    count = 0
+    stack = [str(upload_path)]
+    
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not is_excluded_dir(entry.name):
+                            stack.append(entry.path)
+                    elif entry.is_file() and entry.name != META_FILENAME:
+                        count += 1
+        except OSError as e:
+            logger.warning(f"Error reading directory while counting files: {e}")
+    
+    return count
+
+
+def write_upload_meta(upload_path: Path, content_hashes: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    Write the sidecar metadata for a freshly extracted upload.
+    
+    Args:
+        upload_path: Extracted upload directory
+        content_hashes: Optional {relative_path: sha256} computed during extraction
+    """
+    meta = {
+        'file_count': count_files(upload_path),
+        'uploaded_at': datetime.now().isoformat(),
+        'content_hashes': content_hashes or {}
+    }
+    
+    try:
+        (upload_path / META_FILENAME).write_text(json.dumps(meta), encoding='utf-8')
+    except OSError as e:
+        logger.warning(f"Failed to write upload metadata for {upload_path}: {e}")
+    
+    return meta
+
+
+def read_upload_meta(upload_path: Path) -> Optional[Dict]:
+    """Read the sidecar metadata for an upload, or None if it is missing."""
+    try:
+        return json.loads((upload_path / META_FILENAME).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Invalid upload metadata for {upload_path}: {e}")
+        return None
+
+
+def _read_digest_index(upload_root: Path) -> Dict[str, str]:
+    try:
+        return json.loads((upload_root / DIGEST_INDEX_FILENAME).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Invalid upload digest index in {upload_root}: {e}")
+        return {}
+
+
+def find_upload_by_digest(upload_root: Path, digest: str) -> Optional[str]:
+    """Return the upload_id of a completed upload with the same ZIP digest, if any."""
+    upload_id = _read_digest_index(upload_root).get(digest)
+    if upload_id and (upload_root / upload_id / META_FILENAME).exists():
+        return upload_id
+    return None
+
+
+def record_upload_digest(upload_root: Path, digest: str, upload_id: str):
+    """
+    Remember which upload a ZIP digest was extracted to. Blocking; call it off
+    the event loop. The index is only a hint for skipping extraction, so an
+    entry lost to a concurrent writer in another worker process just means the
+    next identical upload is extracted again.
+    """
+    with _digest_index_lock:
+        index = _read_digest_index(upload_root)
+        
+        # Drop entries whose uploads have since been deleted
+        index = {d: uid for d, uid in index.items() if (upload_root / uid).exists()}
+        index[digest] = upload_id
+        
+        # Write a uniquely named temp file and swap it in, so readers never see a partial index
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=upload_root, prefix=DIGEST_INDEX_FILENAME, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, upload_root / DIGEST_INDEX_FILENAME)
+        except OSError as e:
+            logger.warning(f"Failed to record upload digest for {upload_id}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
@@ -0,0 +1,176 @@
+"""
+Tests for the bounded TTL cache and stale-while-revalidate metadata serving.
+"""
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.routes import comparison
+from utils.cache import TTLCache
+
+
+class FakeTimer:
+    """Manually advanced clock for TTLCache."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def timer():
+    return FakeTimer()
+
+
+def test_entries_expire_after_ttl(timer):
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache['a'] = 1
+
+    timer.now = 59
+    assert cache['a'] == 1
+
+    timer.now = 60
+    assert 'a' not in cache
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_get_stale_serves_expired_entries(timer):
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache['a'] = 1
+    timer.now = 120
+
+    assert 'a' not in cache
+    assert cache.get_stale('a') == 1
+    assert cache.get_stale('missing') is None
+
+
+def test_setting_an_entry_refreshes_its_ttl(timer):
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache['a'] = 1
+    timer.now = 100
+    cache['a'] = 2
+
+    assert cache['a'] == 2
+
+
+def test_least_recently_used_entry_is_evicted(timer):
+    cache = TTLCache(maxsize=2, ttl=60, timer=timer)
+    cache['a'] = 1
+    cache['b'] = 2
+    cache['a']  # 'b' is now least recently used
+    cache['c'] = 3
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get_stale('b') is None
+    assert 'c' in cache
+
+
+def test_pop_ignores_expired_entries(timer):
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache['a'] = 1
+    cache['b'] = 2
+    timer.now = 61
+
+    assert cache.pop('a', None) is None
+    assert cache.get_stale('a') is None
+    with pytest.raises(KeyError):
+        cache.pop('b')
+
+
+def test_concurrent_writers_respect_maxsize():
+    cache = TTLCache(maxsize=50, ttl=60)
+
+    def write(offset: int):
+        for i in range(2000):
+            cache[offset + i] = i
+            cache.get(offset + i - 1)
+
+    threads = [threading.Thread(target=write, args=(n * 10_000,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(cache) == 50
+
+
+class FakeBuilder:
+    """Stands in for MetadataBuilder, counting builds per upload."""
+
+    builds = []
+
+    def __init__(self, upload_dir):
+        self.upload_dir = upload_dir
+
+    def build_metadata(self, upload_id: str):
+        self.builds.append(upload_id)
+        return SimpleNamespace(version=len(self.builds), total_files=0)
+
+
+@pytest.fixture
+def metadata_env(tmp_path, monkeypatch, timer):
+    """Metadata routes over a temporary uploads dir, a fake builder and a fake clock."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'uploads' / 'u1').mkdir(parents=True)
+    FakeBuilder.builds = []
+    monkeypatch.setattr(comparison, 'MetadataBuilder', FakeBuilder)
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    monkeypatch.setattr(comparison, '_get_metadata_cache', lambda: cache)
+    monkeypatch.setattr(comparison, '_refreshing', set())
+    return cache
+
+
+async def wait_for_refresh(upload_id: str):
+    """Wait for the background revalidation of an upload to finish."""
+    for _ in range(200):
+        if upload_id not in comparison._refreshing:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"refresh of {upload_id} did not finish")
+
+
+@pytest.mark.asyncio
+async def test_metadata_is_cached(metadata_env):
+    first = await comparison.get_codebase_metadata('u1', refresh=False)
+    second = await comparison.get_codebase_metadata('u1', refresh=False)
+
+    assert first is second
+    assert FakeBuilder.builds == ['u1']
+
+
+@pytest.mark.asyncio
+async def test_expired_metadata_is_served_stale_while_revalidating(metadata_env, timer):
+    await comparison.get_codebase_metadata('u1', refresh=False)
+    timer.now = 120
+
+    stale = await comparison.get_codebase_metadata('u1', refresh=False)
+    assert stale.version == 1
+
+    await wait_for_refresh('u1')
+    assert FakeBuilder.builds == ['u1', 'u1']
+    assert (await comparison.get_codebase_metadata('u1', refresh=False)).version == 2
+
+
+@pytest.mark.asyncio
+async def test_only_one_revalidation_runs_at_a_time(metadata_env, timer):
+    await comparison.get_codebase_metadata('u1', refresh=False)
+    timer.now = 120
+    comparison._refreshing.add('u1')  # a refresh is already in flight
+
+    assert (await comparison.get_codebase_metadata('u1', refresh=False)).version == 1
+    await asyncio.sleep(0.05)
+
+    assert FakeBuilder.builds == ['u1']
+
+
+@pytest.mark.asyncio
+async def test_refresh_bypasses_cache(metadata_env):
+    await comparison.get_codebase_metadata('u1', refresh=False)
+
+    assert (await comparison.get_codebase_metadata('u1', refresh=True)).version == 2
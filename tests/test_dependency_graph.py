@@ -0,0 +1,59 @@
+"""
+Tests for circular dependency detection (iterative Tarjan SCC).
+"""
+import sys
+from pathlib import Path
+
+from app.services.dependency_graph import DependencyGraphBuilder
+
+
+def detect_cycles(edges):
+    """Run cycle detection over a graph given as (importer, imported) pairs."""
+    builder = DependencyGraphBuilder(Path('.'))
+    for source, target in edges:
+        builder.graph[source].add(target)
+    builder._detect_circular_dependencies()
+    return builder.circular_deps
+
+
+def test_acyclic_graph_has_no_cycles():
+    assert detect_cycles([('a', 'b'), ('b', 'c'), ('a', 'c')]) == []
+
+
+def test_reports_one_cycle_per_component():
+    cycles = detect_cycles([
+        ('a', 'b'), ('b', 'c'), ('c', 'a'),
+        ('c', 'd'),
+        ('x', 'y'), ('y', 'x'),
+    ])
+
+    assert sorted(cycles) == [['a', 'b', 'c', 'a'], ['x', 'y', 'x']]
+
+
+def test_self_import_is_a_cycle():
+    assert detect_cycles([('a', 'a'), ('a', 'b')]) == [['a', 'a']]
+
+
+def test_reports_shortest_cycle_in_component():
+    # a -> b -> c -> d -> a, with a shortcut c -> a
+    cycles = detect_cycles([('a', 'b'), ('b', 'c'), ('c', 'd'), ('d', 'a'), ('c', 'a')])
+
+    assert cycles == [['a', 'b', 'c', 'a']]
+
+
+def test_cycle_starts_at_smallest_member():
+    cycles = detect_cycles([('m', 'z'), ('z', 'b'), ('b', 'm')])
+
+    assert cycles == [['b', 'm', 'z', 'b']]
+
+
+def test_deep_import_chain_does_not_recurse():
+    depth = sys.getrecursionlimit() * 5
+    edges = [(f'n{i}', f'n{i + 1}') for i in range(depth)]
+
+    assert detect_cycles(edges) == []
+
+    cycles = detect_cycles(edges + [(f'n{depth}', 'n0')])
+    assert len(cycles) == 1
+    assert len(cycles[0]) == depth + 2
+    assert cycles[0][0] == cycles[0][-1] == 'n0'
@@ -0,0 +1,75 @@
+"""
+Tests for the in-memory token bucket rate limiter.
+"""
+import pytest
+
+from app import main
+from app.main import RATE_LIMIT_WINDOW_NS, _check_local_rate_limit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.monotonic_ns for the rate limiter, starting with empty buckets."""
+    now = [10 * RATE_LIMIT_WINDOW_NS]
+    monkeypatch.setattr(main.time, 'monotonic_ns', lambda: now[0])
+    monkeypatch.setattr(main, 'rate_limit_buckets', {})
+    monkeypatch.setattr(main, '_last_rate_limit_purge', now[0])
+    return now
+
+
+def test_bucket_allows_burst_up_to_limit(clock):
+    results = [_check_local_rate_limit('1.2.3.4', 5) for _ in range(5)]
+
+    assert all(allowed for allowed, _, _ in results)
+    assert [remaining for _, remaining, _ in results] == [4, 3, 2, 1, 0]
+
+
+def test_bucket_rejects_when_empty_with_retry_after(clock):
+    for _ in range(60):
+        _check_local_rate_limit('1.2.3.4', 60)
+
+    allowed, remaining, retry_after = _check_local_rate_limit('1.2.3.4', 60)
+
+    assert not allowed
+    assert remaining == 0
+    # 60 per minute refills one token per second
+    assert retry_after == 1
+
+
+def test_bucket_refills_over_time(clock):
+    for _ in range(60):
+        _check_local_rate_limit('1.2.3.4', 60)
+    assert not _check_local_rate_limit('1.2.3.4', 60)[0]
+
+    clock[0] += RATE_LIMIT_WINDOW_NS // 2
+
+    results = [_check_local_rate_limit('1.2.3.4', 60)[0] for _ in range(31)]
+    assert results.count(True) == 30
+
+
+def test_bucket_never_exceeds_capacity(clock):
+    _check_local_rate_limit('1.2.3.4', 5)
+    clock[0] += 10 * RATE_LIMIT_WINDOW_NS
+
+    allowed, remaining, _ = _check_local_rate_limit('1.2.3.4', 5)
+
+    assert allowed
+    assert remaining == 4
+
+
+def test_buckets_are_per_client(clock):
+    for _ in range(3):
+        _check_local_rate_limit('1.1.1.1', 3)
+
+    assert not _check_local_rate_limit('1.1.1.1', 3)[0]
+    assert _check_local_rate_limit('2.2.2.2', 3)[0]
+
+
+def test_idle_buckets_are_purged(clock):
+    _check_local_rate_limit('1.1.1.1', 3)
+    clock[0] += RATE_LIMIT_WINDOW_NS + 1
+
+    _check_local_rate_limit('2.2.2.2', 3)
+
+    assert '1.1.1.1' not in main.rate_limit_buckets
+    assert '2.2.2.2' in main.rate_limit_buckets
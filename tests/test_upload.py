@@ -0,0 +1,163 @@
+"""
+Tests for ZIP upload handling: streaming extraction limits and in-memory uploads.
+"""
+import hashlib
+import io
+import struct
+import zipfile
+from tempfile import SpooledTemporaryFile
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from app.routes.upload import IN_MEMORY_ZIP_MAX_SIZE, FileHandler
+
+
+def make_zip(members: dict) -> bytes:
+    """Build a ZIP archive in memory from {name: bytes}."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def understate_file_size(data: bytes, size: int) -> bytes:
+    """Rewrite every member's declared uncompressed size, leaving the content alone."""
+    patched = bytearray(data)
+    offset = patched.find(b'PK\x03\x04')
+    while offset != -1:
+        struct.pack_into('<I', patched, offset + 22, size)  # local file header
+        offset = patched.find(b'PK\x03\x04', offset + 4)
+    offset = patched.find(b'PK\x01\x02')
+    while offset != -1:
+        struct.pack_into('<I', patched, offset + 24, size)  # central directory entry
+        offset = patched.find(b'PK\x01\x02', offset + 4)
+    return bytes(patched)
+
+
+@pytest.fixture
+def handler(tmp_path):
+    """FileHandler writing into a temporary upload directory."""
+    file_handler = FileHandler()
+    file_handler.upload_dir = tmp_path / 'uploads'
+    file_handler.temp_dir = file_handler.upload_dir / 'temp'
+    file_handler.max_size = 10 * 1024 * 1024
+    file_handler.max_extracted_size = 1024
+    return file_handler
+
+
+def test_extract_zip_preserves_structure(handler):
+    data = make_zip({'proj/app/main.py': b'import os\n', 'proj/README.md': b'hi'})
+
+    extract_path = handler.extract_zip(io.BytesIO(data), 'ok')
+
+    assert (extract_path / 'proj' / 'app' / 'main.py').read_bytes() == b'import os\n'
+    assert (extract_path / 'proj' / 'README.md').read_bytes() == b'hi'
+
+
+def test_extract_zip_skips_excluded_dirs(handler):
+    data = make_zip({'proj/main.py': b'x = 1\n', 'proj/node_modules/lib/index.js': b'y'})
+
+    extract_path = handler.extract_zip(io.BytesIO(data), 'excluded')
+
+    assert (extract_path / 'proj' / 'main.py').exists()
+    assert not (extract_path / 'proj' / 'node_modules').exists()
+
+
+@pytest.mark.parametrize('member', ['../evil.py', 'proj/../../evil.py', '/etc/evil.py'])
+def test_extract_zip_rejects_path_traversal(handler, tmp_path, member):
+    data = make_zip({'proj/ok.py': b'ok', member: b'evil'})
+
+    with pytest.raises(HTTPException):
+        handler.extract_zip(io.BytesIO(data), 'traversal')
+
+    assert not (handler.upload_dir / 'traversal').exists()
+    assert not (tmp_path / 'evil.py').exists()
+    assert not (handler.upload_dir / 'evil.py').exists()
+
+
+def test_extract_zip_rejects_declared_size_over_budget(handler):
+    data = make_zip({'big.py': b'a' * 2048})
+
+    with pytest.raises(HTTPException) as exc_info:
+        handler.extract_zip(io.BytesIO(data), 'declared')
+
+    assert exc_info.value.status_code == 400
+    assert not (handler.upload_dir / 'declared').exists()
+
+
+def test_extract_zip_rejects_lying_file_size_header(handler):
+    # Declares 10 bytes but inflates to 4KB, well past the 1KB budget.
+    # zipfile stops at the declared size and then fails the CRC check.
+    data = understate_file_size(make_zip({'bomb.py': b'a' * 4096}), 10)
+
+    with pytest.raises(HTTPException) as exc_info:
+        handler.extract_zip(io.BytesIO(data), 'liar')
+
+    assert exc_info.value.status_code == 400
+    assert not (handler.upload_dir / 'liar').exists()
+
+
+def test_extract_member_stops_at_written_budget(handler, tmp_path):
+    data = make_zip({'big.py': b'a' * 4096})
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        with pytest.raises(HTTPException) as exc_info:
+            handler._extract_member(zf, zf.getinfo('big.py'), tmp_path / 'out', budget=100)
+
+    assert exc_info.value.status_code == 400
+    assert (tmp_path / 'out' / 'big.py').stat().st_size <= 100
+
+
+def test_extract_zip_budget_overflow_removes_partial_extraction(handler):
+    # Each member fits the budget on its own; together they don't
+    data = make_zip({f'proj/part{i}.py': b'b' * 400 for i in range(4)})
+
+    with pytest.raises(HTTPException) as exc_info:
+        handler.extract_zip(io.BytesIO(data), 'overflow')
+
+    assert exc_info.value.status_code == 400
+    assert not (handler.upload_dir / 'overflow').exists()
+
+
+def test_extract_zip_rejects_corrupt_archive(handler):
+    with pytest.raises(HTTPException) as exc_info:
+        handler.extract_zip(io.BytesIO(b'not a zip'), 'corrupt')
+
+    assert exc_info.value.status_code == 400
+    assert not (handler.upload_dir / 'corrupt').exists()
+
+
+@pytest.mark.asyncio
+async def test_small_upload_is_extracted_from_spooled_file(handler):
+    data = make_zip({'proj/main.py': b'print("hi")\n'})
+    assert len(data) <= IN_MEMORY_ZIP_MAX_SIZE
+    spooled = SpooledTemporaryFile(max_size=IN_MEMORY_ZIP_MAX_SIZE)
+    spooled.write(data)
+    spooled.seek(0)
+    upload = UploadFile(file=spooled, size=len(data), filename='proj.zip')
+
+    upload_id, temp_file_path, file_size, digest = await handler.save_upload(upload)
+
+    # No temp copy: the request's spooled file is extracted directly
+    assert temp_file_path is None
+    assert not handler.temp_dir.exists()
+    assert file_size == len(data)
+    assert digest == hashlib.sha256(data).hexdigest()
+
+    extract_path = handler.extract_zip(upload.file, upload_id)
+    assert (extract_path / 'proj' / 'main.py').read_bytes() == b'print("hi")\n'
+
+
+@pytest.mark.asyncio
+async def test_large_upload_is_spooled_to_temp_file(handler, monkeypatch):
+    monkeypatch.setattr('app.routes.upload.IN_MEMORY_ZIP_MAX_SIZE', 10)
+    data = make_zip({'proj/main.py': b'print("hi")\n'})
+    upload = UploadFile(file=io.BytesIO(data), size=len(data), filename='proj.zip')
+
+    upload_id, temp_file_path, file_size, digest = await handler.save_upload(upload)
+
+    assert temp_file_path is not None
+    assert temp_file_path.read_bytes() == data
+    assert digest == hashlib.sha256(data).hexdigest()
@@ -0,0 +1,129 @@
+"""
+Bounded in-memory caches for long-running server processes,
+plus size/age pruning for on-disk caches of one file per entry.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+_MISSING = object()
+
+
+class TTLCache(MutableMapping):
+    """
+    LRU cache with a per-entry time-to-live.
+    
+    Behaves like a dict for `in`, `[]` and `del`, but holds at most `maxsize`
+    entries (least recently used are evicted first) and treats entries older
+    than `ttl` seconds as missing. Expired entries are kept until evicted so
+    callers can still serve them while refreshing (see `get_stale`).
+    Thread-safe, so background refreshes can write from executor threads.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+    
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            expires_at, value = self._data[key]
+            if expires_at <= self._timer():
+                raise KeyError(key)
+            self._data.move_to_end(key)
+            return value
+    
+    def __setitem__(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (self._timer() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def __delitem__(self, key: Hashable):
+        with self._lock:
+            del self._data[key]
+    
+    def __iter__(self) -> Iterator:
+        now = self._timer()
+        with self._lock:
+            return iter([key for key, (expires_at, _) in self._data.items() if expires_at > now])
+    
+    def __len__(self) -> int:
+        now = self._timer()
+        with self._lock:
+            return sum(1 for expires_at, _ in self._data.values() if expires_at > now)
+    
+    def pop(self, key: Hashable, default: Any = _MISSING) -> Any:
+        """Remove and return a live value in one step (the mixin's get-then-delete can race)."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is not None and entry[0] > self._timer():
+            return entry[1]
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+    
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        """Return a value even if it has expired, or None if it was never cached or was evicted."""
+        with self._lock:
+            entry = self._data.get(key)
+        return entry[1] if entry else None
+
+
+def touch_cache_entry(path: os.PathLike):
+    """Mark an on-disk cache entry as recently used, for `prune_cache_dir`'s LRU order."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def prune_cache_dir(
+    directory: os.PathLike,
+    max_entries: Optional[int] = None,
+    max_age_seconds: Optional[float] = None,
+    suffix: str = '.json'
+) -> int:
+    """
+    Bound an on-disk cache that stores one `suffix` file per entry.
+    
+    Deletes entries unused for `max_age_seconds`, then the least recently used
+    beyond `max_entries` (oldest mtime first; readers refresh it with
+    `touch_cache_entry`). Safe to run while other processes read and write
+    the cache. Returns the number of entries removed.
+    """
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(suffix):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        continue
+    except FileNotFoundError:
+        return 0
+    
+    entries.sort()
+    doomed = 0
+    if max_age_seconds is not None:
+        cutoff = time.time() - max_age_seconds
+        while doomed < len(entries) and entries[doomed][0] < cutoff:
+            doomed += 1
+    if max_entries is not None:
+        doomed = max(doomed, len(entries) - max_entries)
+    
+    removed = 0
+    for _, path in entries[:doomed]:
+        try:
+            os.unlink(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
@@ -6,10 +6,11 @@ import shutil
 import time
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import List
+from typing import Iterable, List
 import threading
 import schedule
 
+from utils.cache import prune_cache_dir
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -23,10 +24,17 @@ class FileCleanupManager:
         upload_dir: Path,
         summaries_dir: Path,
         max_age_days: int = 7,
-        cleanup_interval_hours: int = 24
+        cleanup_interval_hours: int = 24,
+        shared_cache_dirs: Iterable[str] = ()
     ):
+        """
+        shared_cache_dirs: names of directories under summaries_dir that hold
+        content-addressed caches shared across uploads. Their entries expire
+        individually by last use instead of the whole directory by its mtime.
+        """
         self.upload_dir = Path(upload_dir)
         self.summaries_dir = Path(summaries_dir)
+        self.shared_cache_dirs = frozenset(shared_cache_dirs)
         self.max_age_days = max_age_days
         self.cleanup_interval_hours = cleanup_interval_hours
         self._stop_event = threading.Event()
@@ -62,7 +70,11 @@ class FileCleanupManager:
         # Clean summaries
         try:
             for summary_path in self.summaries_dir.iterdir():
-                if summary_path.is_dir():
+                if summary_path.name in self.shared_cache_dirs:
+                    removed = prune_cache_dir(summary_path, max_age_seconds=self.max_age_days * 86400)
+                    if removed:
+                        logger.info(f"Expired {removed} entries from {summary_path}")
+                elif summary_path.is_dir():
                     if summary_path.stat().st_mtime < cutoff_time:
                         size = self._get_dir_size(summary_path)
                         shutil.rmtree(summary_path)
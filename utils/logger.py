@@ -5,7 +5,35 @@ import logging
 import sys
 from datetime import datetime
 from pathlib import Path
-from pythonjsonlogger import jsonlogger
+
+import orjson
+
+# Attributes every LogRecord carries; anything else was passed via `extra`
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON using orjson."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        log_record = {
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'severity': record.levelname,
+            'name': record.name,
+            'message': record.getMessage(),
+            'pathname': record.pathname,
+            'lineno': record.lineno,
+        }
+        
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                # Callers pass their own timestamp; it replaces the record time
+                log_record['time' if key == 'timestamp' else key] = value
+        
+        if record.exc_info:
+            log_record['exc_info'] = self.formatException(record.exc_info)
+        
+        return orjson.dumps(log_record, default=str).decode()
 
 
 def setup_logger(name: str, log_level: str = 'INFO', log_format: str = 'json') -> logging.Logger:
@@ -31,10 +59,7 @@ def setup_logger(name: str, log_level: str = 'INFO', log_format: str = 'json') -
     
     if log_format == 'json':
         # JSON formatter for production
-        formatter = jsonlogger.JsonFormatter(
-            '%(timestamp)s %(level)s %(name)s %(message)s %(pathname)s %(lineno)d',
-            rename_fields={'level': 'severity', 'timestamp': 'time'}
-        )
+        formatter = JsonFormatter()
     else:
         # Simple text formatter for development
         formatter = logging.Formatter(
@@ -64,6 +89,9 @@ class RequestLogger:
     
     def log_request(self, method: str, path: str, status_code: int, duration_ms: float):
         """Log API request with timing."""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        
         self.logger.info(
             "API Request",
             extra={